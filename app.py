@@ -1,46 +1,1283 @@
 import streamlit as st
 import pandas as pd
-from supabase import create_client, Client
+import httpx
+from supabase import create_client, Client, ClientOptions
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import chain
+import base64
+import csv
+import gzip
+import hashlib
+import io
 import json
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import sqlite3
+import threading
+import time
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from fleet_metrics import trip_km, live_mileage, fill_mileage, monthly_mileage, cost_per_km
+
+# --- 1. PERF TRACE ---
+# Off by default. When a manager switches it on (Diagnostics section) every rerun records how long
+# each step took and every Supabase call it made, into a small ring buffer shared by the process.
+# Switched off, each step below is a single dictionary lookup.
+PERF_BUFFER = 300          # Reruns and background jobs kept for the Diagnostics section
+PERF_OPS = ("select", "insert", "update", "upsert", "delete")
+
+@st.cache_resource
+def _perf():
+    return {"enabled": False, "runs": deque(maxlen=PERF_BUFFER), "active": threading.local()}
+
+PERF = _perf()
+
+def perf_start(kind, label):
+    now = time.perf_counter()
+    run = {"started": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "kind": kind, "label": label,
+           "laps": {}, "calls": [], "t0": now, "last": now, "open": True}
+    PERF["active"].run = run
+    return run
+
+def perf_lap(step):
+    # Time since the previous lap, booked under `step`
+    run = getattr(PERF["active"], "run", None)
+    if run is None or not run["open"]: return
+    now = time.perf_counter()
+    run["laps"][step] = run["laps"].get(step, 0.0) + (now - run["last"]) * 1000
+    run["last"] = now
+
+def perf_label(label):
+    run = getattr(PERF["active"], "run", None)
+    if run is not None: run["label"] = label
+
+def perf_finish(run):
+    # st.rerun()/st.stop() end a script early, so an unfinished run is closed at its last lap or call
+    if run is None or not run["open"]: return
+    run["open"] = False
+    run["total_ms"] = round((run["last"] - run["t0"]) * 1000, 1)
+    run["laps"] = {k: round(v, 1) for k, v in run["laps"].items()}
+    PERF["runs"].append(run)
+    if getattr(PERF["active"], "run", None) is run: PERF["active"].run = None
+
+def perf_runs():
+    return [{k: v for k, v in r.items() if k not in ("t0", "last", "open")} for r in list(PERF["runs"])]
+
+class _Traced:
+    """Stands in for the Supabase client and every query builder it hands out, timing each execute()."""
+    __slots__ = ("_target", "_run", "_table", "_op")
+
+    def __init__(self, target, run, table="", op=""):
+        self._target, self._run, self._table, self._op = target, run, table, op
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name == "execute": return self._execute
+        if not callable(attr): return attr
+        def call(*args, **kwargs):
+            table = self._table or (f"rpc:{args[0]}" if name == "rpc" else str(args[0]) if args else name)
+            return _Traced(attr(*args, **kwargs), self._run, table, self._op or (name if name in PERF_OPS else ""))
+        return call
+
+    def _execute(self):
+        start, end, rows, size = time.perf_counter(), None, 0, 0
+        try:
+            res = self._target.execute()
+            end = time.perf_counter()      # Taken before the size is measured, so json.dumps is not billed to Supabase
+            data = res.data
+            rows = len(data) if isinstance(data, list) else int(data is not None)
+            size = len(json.dumps(data, default=str)) if data else 0   # JSON size, close to the bytes on the wire
+            return res
+        finally:
+            end = end or time.perf_counter()
+            # Pool threads of fetch_rows() report to the rerun that created this client
+            run = getattr(PERF["active"], "run", None) or self._run
+            if run["open"]:
+                run["calls"].append((self._table, self._op or "rpc", round((end - start) * 1000, 1), rows, size))
+                run["last"] = max(run["last"], end)
+
+def perf_summary(runs):
+    """(per section, time per step, calls per table, slowest reruns) as DataFrames."""
+    reruns = pd.DataFrame([{"started": r["started"], "kind": r["kind"], "section": r["label"], "total_ms": r["total_ms"],
+                            "calls": len(r["calls"]), "rows": sum(c[3] for c in r["calls"]),
+                            "KB": round(sum(c[4] for c in r["calls"]) / 1024, 1)} for r in runs])
+    q = lambda p: (lambda x: round(x.quantile(p), 1))
+    sections = reruns.groupby("section").agg(runs=("total_ms", "size"), p50_ms=("total_ms", q(0.5)), p95_ms=("total_ms", q(0.95)),
+                                             avg_calls=("calls", "mean"), avg_KB=("KB", "mean")).round(1).reset_index()
+    laps = pd.DataFrame([{"section": r["label"], "step": k, "ms": v} for r in runs for k, v in r["laps"].items()])
+    steps = laps.pivot_table(index="section", columns="step", values="ms", aggfunc="median").round(1).reset_index() if not laps.empty else laps
+    calls = pd.DataFrame([c for r in runs for c in r["calls"]], columns=["table", "op", "ms", "rows", "bytes"])
+    tables = calls.groupby(["table", "op"]).agg(calls=("ms", "size"), p50_ms=("ms", q(0.5)), p95_ms=("ms", q(0.95)),
+                                                rows=("rows", "sum"), KB=("bytes", lambda b: round(b.sum() / 1024, 1))).reset_index()
+    return sections, steps, tables.sort_values("calls", ascending=False), reruns.nlargest(10, "total_ms")
+
+perf_finish(st.session_state.pop("_perf_run", None))
+if PERF["enabled"]:
+    st.session_state["_perf_run"] = perf_start("rerun", "Login")
+
+# --- 2. SECURE CONNECTION ---
+# ONE client for the whole server process, shared by every session and by the backup engine.
+# Its HTTP pool keeps idle connections open, so a click does not pay for a new TLS handshake.
+POOL_SIZE = 8
+KEEPALIVE_SECS = 300
+HEALTH_CHECK_SECS = 120
+
+def _new_client():
+    http = httpx.Client(
+        limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE, keepalive_expiry=KEEPALIVE_SECS),
+        timeout=30, follow_redirects=True
+    )
+    return create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"], options=ClientOptions(httpx_client=http)), http
+
+@st.cache_resource
+def _connection():
+    client, http = _new_client()
+    return {"client": client, "http": http, "healthy": True, "checked": time.time(), "reconnects": 0, "error": "", "lock": threading.Lock()}
+
+def check_connection():
+    # Cheap ping; if the connection dropped, build a fresh client for every later call. The old one is
+    # NOT closed: running jobs and fetch_rows() pool threads still hold it, and it is dropped with them.
+    conn = _connection()
+    with conn["lock"]:
+        conn["checked"] = time.time()
+        try:
+            conn["client"].table("vehicles").select("plate").limit(1).execute()
+        except Exception:
+            try:
+                conn["client"], conn["http"] = _new_client()
+                conn["reconnects"] += 1
+                conn["client"].table("vehicles").select("plate").limit(1).execute()
+            except Exception as e:
+                conn["healthy"] = False; conn["error"] = str(e)
+                return False
+        conn["healthy"] = True; conn["error"] = ""
+        return True
+
+def get_supabase():
+    conn = _connection()
+    if time.time() - conn["checked"] > HEALTH_CHECK_SECS:
+        check_connection()
+    return conn["client"]
 
-# --- 1. SECURE CONNECTION ---
 try:
-    URL = st.secrets["SUPABASE_URL"]
-    KEY = st.secrets["SUPABASE_KEY"]
-    supabase: Client = create_client(URL, KEY)
+    supabase: Client = get_supabase()
+    if "_perf_run" in st.session_state: supabase = _Traced(supabase, st.session_state["_perf_run"])
 except Exception as e:
     st.error("⚠️ Connection Error. Check Streamlit Secrets.")
     st.stop()
+perf_lap("connect")
+
+# --- 3. DATA LOADER ---
+# Tables are cached once for ALL sessions. Every table has a version number and
+# each write bumps the versions of the tables it touched, so only those are refetched.
+CACHE_TTL = 600
+PAGE_SIZE = 1000        # PostgREST returns at most this many rows per request
+FETCH_WORKERS = 4
+ORDER_KEYS = {"vehicles": "plate", "vehicle_rollups": "plate,period,driver"}   # Stable paging order, everything else pages by "id"
+LOG_COLUMNS = "id,date,plate,driver,km_run,liters,mileage,rate_per_ltr,total_cost"
+MAINT_COLUMNS = "id,date,plate,work_type,cost,notes,odo"
+INCREMENTAL_SLOTS = 8   # Incremental frames kept per process; the least recently used one is dropped
+
+@st.cache_resource
+def _table_versions():
+    return {}
+
+@st.cache_resource
+def _incremental_frames():
+    return {}
+
+def invalidate(*tables, appended=False):
+    # appended=True means rows were only ADDED, so incremental loads just fetch the new tail
+    versions = _table_versions()
+    for t in tables:
+        rev, tail = versions.get(t, (0, 0))
+        versions[t] = (rev, tail + 1) if appended else (rev + 1, tail)
+
+def fetch_rows(table_name, columns="*", plate=None, date_from=None, date_to=None, after_id=None, updated_since=None, period=None):
+    """Fetches every matching row page by page (a single select is capped at PAGE_SIZE rows)."""
+    key = ORDER_KEYS.get(table_name, "id")
+
+    def page(start, size, count=None):
+        q = supabase.table(table_name).select(columns, count=count)
+        if plate: q = q.eq("plate", plate)
+        if date_from: q = q.gte("date", str(date_from))
+        if date_to: q = q.lte("date", f"{date_to} 23:59:59")
+        if after_id is not None: q = q.gt(key, after_id)
+        if updated_since: q = q.gte("updated_at", updated_since)
+        if period: q = q.eq("period", period)
+        for k in key.split(","): q = q.order(k)
+        return q.range(start, start + size - 1).execute()
+
+    first = page(0, PAGE_SIZE, "exact")
+    pages = [first.data]
+    step = len(first.data)
+    if step and first.count and first.count > step:
+        # The server may cap pages below PAGE_SIZE, so keep stepping by what it actually returned
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+            pages += list(pool.map(lambda s: page(s, step).data, range(step, first.count, step)))
+    # One flat list of records -> one DataFrame build, no per-page frames to concatenate
+    return list(chain.from_iterable(pages))
 
-# --- 2. DATA LOADER ---
-def load_data(table_name):
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _fetch_table(table_name, columns, plate, date_from, date_to, version):
+    return pd.DataFrame(fetch_rows(table_name, columns, plate, date_from, date_to))
+
+def _load_incremental(table_name, columns, plate, date_from, date_to):
+    # Keeps one frame per query and, as long as rows were only appended, fetches just the rows after the last id.
+    # After CACHE_TTL the whole frame is fetched again, so edits made outside this process show up.
+    rev, tail = _table_versions().get(table_name, (0, 0))
+    store = _incremental_frames()
+    slot = (table_name, columns, plate, date_from, date_to)
+    entry = store.pop(slot, None)
+    if (entry is None or entry["rev"] != rev or entry["frame"].empty or "id" not in entry["frame"].columns
+            or time.time() - entry["at"] > CACHE_TTL):
+        frame, at = pd.DataFrame(fetch_rows(table_name, columns, plate, date_from, date_to)), time.time()
+    elif entry["tail"] != tail:
+        new_rows = fetch_rows(table_name, columns, plate, date_from, date_to, after_id=int(entry["frame"]["id"].max()))
+        frame = pd.concat([entry["frame"], pd.DataFrame(new_rows)], ignore_index=True) if new_rows else entry["frame"]
+        at = entry["at"]
+    else:
+        frame, at = entry["frame"], entry["at"]
+    # Re-inserted last, so the dict order is least -> most recently used
+    store[slot] = {"rev": rev, "tail": tail, "frame": frame, "at": at}
+    while len(store) > INCREMENTAL_SLOTS:
+        try: store.pop(next(iter(store)))
+        except: break
+    return frame.copy()
+
+def load_data(table_name, columns="*", plate=None, date_from=None, date_to=None, incremental=False):
     try:
-        res = supabase.table(table_name).select("*").execute()
-        return pd.DataFrame(res.data)
+        date_from = str(date_from) if date_from else None
+        date_to = str(date_to) if date_to else None
+        if incremental:
+            return _load_incremental(table_name, columns, plate, date_from, date_to)
+        return _fetch_table(table_name, columns, plate, date_from, date_to, _table_versions().get(table_name, (0, 0)))
     except:
         return pd.DataFrame()
 
-df = load_data("vehicles")
+# --- 4. WRITE QUEUE ---
+# Vehicle updates (driver odometer, odometer corrections, driver names) are saved in a local SQLite
+# file first and acknowledged at once; one background thread pushes them to Supabase with retries.
+# Each plate has ONE pending row: a new update is merged into it, and a driver's odometer only moves up.
+# Rows are tagged with the Supabase project they were written for and only ever sent there.
+WRITE_QUEUE_DB = os.environ.get("AKSHARA_WRITE_QUEUE_DB") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "write_queue.db")
+FLUSH_EVERY = 5         # Seconds between flushes when nothing new was queued
+MAX_BACKOFF = 120       # Seconds; a failing plate waits 2, 4, 8 ... seconds up to this
+
+@st.cache_resource
+def write_queue():
+    db = sqlite3.connect(WRITE_QUEUE_DB, check_same_thread=False, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("""CREATE TABLE IF NOT EXISTS vehicle_writes (
+        project TEXT NOT NULL, plate TEXT NOT NULL, payload TEXT NOT NULL, monotonic INTEGER NOT NULL, version INTEGER NOT NULL,
+        queued TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_try REAL NOT NULL DEFAULT 0, error TEXT NOT NULL DEFAULT '',
+        PRIMARY KEY (project, plate))""")
+    db.execute("CREATE TABLE IF NOT EXISTS rollup_state (project TEXT PRIMARY KEY, error TEXT NOT NULL, since TEXT NOT NULL)")
+    project = st.secrets["SUPABASE_URL"]
+    q = {"db": db, "project": project, "lock": threading.Lock(), "wake": threading.Event(), "ctx": None, "version": 0, "synced": {},
+         # In-memory copy of this project's rows so a rerun never touches the file
+         "pending": {r[0]: {"payload": json.loads(r[1]), "monotonic": bool(r[2]), "version": r[3], "queued": r[4], "attempts": r[5], "error": r[6]}
+                     for r in db.execute("SELECT plate, payload, monotonic, version, queued, attempts, error FROM vehicle_writes WHERE project = ?", (project,))},
+         # Set when a rollup update failed: vehicle_rollups is not read again until rebuild_rollups() succeeds
+         "rollups_stale": db.execute("SELECT error, since FROM rollup_state WHERE project = ?", (project,)).fetchone()}
+    threading.Thread(target=_flush_loop, args=(q,), daemon=True, name="write-queue").start()
+    return q
+
+def queue_vehicle_update(plate, fields, monotonic=False):
+    """Queues a vehicles update for `plate`. monotonic=True (driver readings) never lowers the odometer."""
+    q = write_queue()
+    with q["lock"]:
+        entry = q["pending"].get(plate)
+        if entry:
+            payload = dict(entry["payload"])
+            if monotonic and "odo" in payload: fields = {**fields, "odo": max(payload["odo"], fields["odo"])}
+            payload.update(fields)
+            # A manager correction in the same row must still be able to lower the odometer
+            monotonic = monotonic and entry["monotonic"]
+            version = entry["version"] + 1
+        else:
+            payload, version = dict(fields), 1
+        queued = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        q["db"].execute("INSERT OR REPLACE INTO vehicle_writes (project, plate, payload, monotonic, version, queued) VALUES (?, ?, ?, ?, ?, ?)",
+                        (q["project"], plate, json.dumps(payload), int(monotonic), version, queued))
+        q["pending"][plate] = {"payload": payload, "monotonic": monotonic, "version": version, "queued": queued, "attempts": 0, "error": ""}
+        q["version"] += 1
+        q["ctx"] = get_script_run_ctx()
+    q["wake"].set()
+
+def _push(plate, entry):
+    query = _connection()["client"].table("vehicles").update(entry["payload"]).eq("plate", plate)
+    if entry["monotonic"]: query = query.lt("odo", entry["payload"]["odo"])   # A stale reading never rewinds the meter
+    query.execute()
+
+def _flush_loop(q):
+    while True:
+        q["wake"].wait(FLUSH_EVERY); q["wake"].clear()
+        try: _flush(q)
+        except: pass
+
+def _flush(q):
+    # Every due plate is sent in parallel; a plate updated again while in flight stays queued
+    with q["lock"]: due = {p: dict(e) for p, e in q["pending"].items()}
+    now = time.time()
+    due = {p: e for p, e in due.items() if e.get("next_try", 0) <= now}
+    if not due: return
+    if q["ctx"] is not None: add_script_run_ctx(threading.current_thread(), q["ctx"])
+    with ThreadPoolExecutor(max_workers=BULK_WORKERS) as pool:
+        results = dict(zip(due, pool.map(lambda item: _try_push(*item), due.items())))
+    with q["lock"]:
+        for plate, error in results.items():
+            entry = q["pending"].get(plate)
+            if entry is None or entry["version"] != due[plate]["version"]: continue   # Changed while in flight: send again
+            if error is None:
+                q["db"].execute("DELETE FROM vehicle_writes WHERE project = ? AND plate = ? AND version = ?", (q["project"], plate, entry["version"]))
+                del q["pending"][plate]
+                q["synced"][plate] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            else:
+                entry["attempts"] += 1; entry["error"] = error
+                entry["next_try"] = time.time() + min(MAX_BACKOFF, 2 ** entry["attempts"])
+                q["db"].execute("UPDATE vehicle_writes SET attempts = ?, next_try = ?, error = ? WHERE project = ? AND plate = ?",
+                                (entry["attempts"], entry["next_try"], error, q["project"], plate))
+        q["version"] += 1
+    if any(e is None for e in results.values()): invalidate("vehicles")
+
+def _try_push(plate, entry):
+    try:
+        _push(plate, entry); return None
+    except Exception as e:
+        return str(e)
+
+def with_pending(vehicles):
+    """The vehicles frame with every queued, not yet synced, update applied on top."""
+    pending = write_queue()["pending"]
+    if not pending or vehicles.empty: return vehicles
+    vehicles = vehicles.copy()
+    for plate, entry in list(pending.items()):
+        for col, value in entry["payload"].items():
+            if col in vehicles.columns: vehicles.loc[vehicles['plate'] == plate, col] = value
+    return vehicles
+
+def sync_status(plate=None):
+    """Pending entries ({plate: entry}) and the time each plate last synced."""
+    q = write_queue()
+    pending = {p: e for p, e in q["pending"].items() if plate is None or p == plate}
+    return pending, (q["synced"].get(plate) if plate else dict(q["synced"]))
+
+def sync_badge(plate):
+    pending, synced_at = sync_status(plate)
+    if pending:
+        entry = pending[plate]
+        st.caption(f"⏳ Saved at {entry['queued']}, waiting to sync" + (f" (retry {entry['attempts']}: {entry['error']})" if entry['attempts'] else ""))
+    elif synced_at:
+        st.caption(f"✅ Synced at {synced_at}")
+
+# ONE read-only copy of the fleet for every session, rebuilt when vehicles (or a queued update) changes
+# and at least every CACHE_TTL seconds. Lookups by plate or by driver are dictionary hits instead of scans.
+def _build_fleet(vehicles):
+    records = vehicles.to_dict('records') if 'plate' in vehicles.columns else []
+    frame = vehicles.copy()
+    for c in ('plate', 'driver'):
+        if c in frame.columns: frame[c] = frame[c].astype('category')
+    for c in ('odo', 'trip_km'):
+        if c in frame.columns: frame[c] = pd.to_numeric(frame[c], errors='coerce').fillna(0).astype('int32')
+    return {"frame": frame, "plates": [r['plate'] for r in records], "by_plate": {r['plate']: r for r in records},
+            "by_driver": {str(r['driver']).upper().strip(): r['plate'] for r in records if r.get('driver')}}
+
+@st.cache_resource(ttl=CACHE_TTL, max_entries=2, show_spinner=False)
+def _fleet_index(version, queued):
+    # Calls _fetch_table directly so a failed fetch raises here instead of caching an empty fleet
+    vehicles = _fetch_table("vehicles", "*", None, None, None, version)
+    if vehicles.empty: raise ValueError("no vehicles loaded")
+    return _build_fleet(with_pending(vehicles))
+
+def fleet_index():
+    try:
+        return _fleet_index(_table_versions().get("vehicles", (0, 0)), write_queue()["version"])
+    except:
+        # Not cached: the next rerun tries the shared index again
+        return _build_fleet(with_pending(load_data("vehicles")))
+
+fleet = fleet_index()
+df = fleet["frame"]     # Shared by every session: never modify it in place
+perf_lap("fleet")
+
+# --- 5. BULK OPERATIONS ---
+# Mass writes go out as multi-row batches (in_() deletes, multi-row upserts) on a few parallel
+# connections. Every operation is safe to run again, so an interrupted one is simply restarted.
+BULK_BATCH = 500
+BULK_WORKERS = 4
+BULK_RETRIES = 2
+
+def _run_batches(items, send, batch_size, workers, progress):
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+    def attempt(batch):
+        for n in range(BULK_RETRIES + 1):
+            try: return send(batch)
+            except Exception:
+                if n == BULK_RETRIES: raise
+                time.sleep(1 + n)
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch, _ in zip(batches, pool.map(attempt, batches)):
+            done += len(batch)
+            progress(done, len(items))
+    return done
+
+def bulk_delete(table_name, key, values, batch_size=BULK_BATCH, workers=BULK_WORKERS, progress=lambda done, total: None):
+    values = list(values)
+    return _run_batches(values, lambda b: supabase.table(table_name).delete().in_(key, b).execute(), batch_size, workers, progress)
+
+def bulk_upsert(table_name, rows, on_conflict, batch_size=BULK_BATCH, workers=BULK_WORKERS, progress=lambda done, total: None):
+    return _run_batches(list(rows), lambda b: supabase.table(table_name).upsert(b, on_conflict=on_conflict).execute(), batch_size, workers, progress)
+
+def bulk_insert(table_name, rows, batch_size=BULK_BATCH, workers=BULK_WORKERS, progress=lambda done, total: None):
+    """Multi-row inserts. Not idempotent on its own: rows that carry their key should use bulk_upsert."""
+    return _run_batches(list(rows), lambda b: supabase.table(table_name).insert(b).execute(), batch_size, workers, progress)
+
+def bulk_wipe(table_name, progress=lambda done, total: None):
+    # Re-reads the remaining keys each round, so a wipe cut short by a timeout finishes on the next run.
+    # Tables with a composite key are deleted by its first column.
+    key = ORDER_KEYS.get(table_name, "id").split(",")[0]
+    erased = 0
+    while True:
+        keys = list(dict.fromkeys(r[key] for r in fetch_rows(table_name, key)))
+        if not keys: return erased
+        erased += bulk_delete(table_name, key, keys, progress=lambda done, total: progress(erased + done, erased + len(keys)))
+
+# --- 6. VEHICLE ROLLUPS ---
+# Running totals per plate ('ALL') and per plate/month/driver, kept in the vehicle_rollups table
+# (see sql/rollups.sql). Every fuel/repair write sends its deltas, so dashboards read O(vehicles) rows.
+# The totals are only read after rebuild_rollups() has written its marker row. A delta that fails
+# deletes the marker and flags the totals locally, so reports read the logs until the next rebuild.
+ROLLUP_KEYS = ['plate', 'period', 'driver']
+ROLLUP_FIELDS = ['km_run', 'liters', 'fuel_cost', 'repairs', 'repair_cost']
+ROLLUP_MARKER = {"plate": "", "period": "REBUILT", "driver": ""}
+
+def fuel_deltas(plate, driver, date, km, liters, cost, sign=1):
+    d = {"km_run": sign * int(km), "liters": sign * float(liters), "fuel_cost": sign * float(cost)}
+    return [{"plate": plate, "period": "ALL", "driver": "", **d},
+            {"plate": plate, "period": str(date)[:7], "driver": driver, **d}]
+
+def repair_deltas(plate, date, cost, sign=1):
+    d = {"repairs": sign, "repair_cost": sign * float(cost)}
+    return [{"plate": plate, "period": "ALL", "driver": "", **d},
+            {"plate": plate, "period": str(date)[:7], "driver": "", **d}]
+
+def apply_rollups(deltas):
+    # Merge deltas per key first: one statement may not touch the same row twice
+    merged = {}
+    for d in deltas:
+        row = merged.setdefault((d['plate'], d['period'], d['driver']), dict.fromkeys(ROLLUP_FIELDS, 0))
+        for f in ROLLUP_FIELDS: row[f] += d.get(f, 0)
+    rows = [{**dict(zip(ROLLUP_KEYS, k)), **v} for k, v in merged.items() if any(v.values())]
+    if not rows: return
+    try:
+        applied = call_rpc("apply_rollup_deltas", {"p_deltas": rows}, strict=True) is not None
+    except Exception as e:
+        # The deltas may or may not have landed, so retrying could count them twice: distrust the totals instead
+        _mark_rollups_stale(str(e))
+        applied = False
+    if not applied:
+        try: supabase.table("vehicle_rollups").delete().eq("period", ROLLUP_MARKER["period"]).execute()
+        except: pass
+    invalidate("vehicle_rollups")
+
+def _mark_rollups_stale(error):
+    q = write_queue()
+    with q["lock"]:
+        since = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        q["db"].execute("INSERT OR REPLACE INTO rollup_state (project, error, since) VALUES (?, ?, ?)", (q["project"], error, since))
+        q["rollups_stale"] = (error, since)
+
+def rollups_stale():
+    """(error, since) of the rollup update that failed after the last rebuild, or None."""
+    return write_queue()["rollups_stale"]
+
+def rebuild_rollups():
+    """Recomputes every total from logs/maintenance and repairs the rows that drifted. Returns how many."""
+    logs = pd.DataFrame(fetch_rows("logs", "plate,driver,date,km_run,liters,total_cost"))
+    maint = pd.DataFrame(fetch_rows("maintenance", "plate,date,cost"))
+    parts = []
+    if not logs.empty:
+        logs['period'] = logs['date'].astype(str).str[:7]
+        logs = logs.rename(columns={'total_cost': 'fuel_cost'})
+        fuel = ['km_run', 'liters', 'fuel_cost']
+        parts.append(logs.groupby(['plate', 'period', 'driver'])[fuel].sum().reset_index())
+        parts.append(logs.groupby('plate')[fuel].sum().reset_index().assign(period="ALL", driver=""))
+    if not maint.empty:
+        maint['period'] = maint['date'].astype(str).str[:7]
+        agg = {'repairs': ('cost', 'count'), 'repair_cost': ('cost', 'sum')}
+        parts.append(maint.groupby(['plate', 'period']).agg(**agg).reset_index().assign(driver=""))
+        parts.append(maint.groupby('plate').agg(**agg).reset_index().assign(period="ALL", driver=""))
+    expected = pd.DataFrame(columns=ROLLUP_KEYS + ROLLUP_FIELDS)
+    if parts:
+        expected = pd.concat(parts, ignore_index=True).fillna({'driver': ""}).groupby(ROLLUP_KEYS)[ROLLUP_FIELDS].sum(min_count=1).fillna(0).reset_index()
+
+    current = pd.DataFrame(fetch_rows("vehicle_rollups", ",".join(ROLLUP_KEYS + ROLLUP_FIELDS)), columns=ROLLUP_KEYS + ROLLUP_FIELDS)
+    current = current[current['period'] != ROLLUP_MARKER['period']]
+    both = expected.merge(current, on=ROLLUP_KEYS, how='outer', suffixes=('', '_db'), indicator=True)
+    for f in ROLLUP_FIELDS: both[[f, f + '_db']] = both[[f, f + '_db']].astype(float).fillna(0.0)
+    drifted = abs(both[ROLLUP_FIELDS].to_numpy() - both[[f + '_db' for f in ROLLUP_FIELDS]].to_numpy()).max(axis=1) > 1e-6
+    fix = both[drifted & (both['_merge'] != 'right_only')]
+    stale = both[both['_merge'] == 'right_only']
+
+    if not fix.empty:
+        rows = fix[ROLLUP_KEYS + ROLLUP_FIELDS].astype({'km_run': int, 'repairs': int}).to_dict('records')
+        bulk_upsert("vehicle_rollups", rows, on_conflict="plate,period,driver")
+    if not stale.empty: _delete_rollup_rows(stale, current)
+    # Every total matches the logs now: mark the table as readable and drop the local flag
+    supabase.table("vehicle_rollups").upsert({**ROLLUP_MARKER, **dict.fromkeys(ROLLUP_FIELDS, 0)}, on_conflict="plate,period,driver").execute()
+    q = write_queue()
+    with q["lock"]:
+        q["db"].execute("DELETE FROM rollup_state WHERE project = ?", (q["project"],))
+        q["rollups_stale"] = None
+    invalidate("vehicle_rollups")
+    return len(fix) + len(stale)
+
+def _delete_rollup_rows(stale, current):
+    # Per period, stale rows go as in_("plate") x in_("driver") batches whenever that cross product
+    # hits no row that must stay; a batch that would is sent as one request per plate-month instead.
+    keep = current.merge(stale[ROLLUP_KEYS], on=ROLLUP_KEYS, how='left', indicator=True)
+    keep = keep[keep['_merge'] == 'left_only']
+    step = BULK_BATCH // 2      # Plates AND drivers go into the URL
+    tasks = []
+    for period, part in stale.sort_values('plate').groupby('period'):
+        kept = keep[keep['period'] == period]
+        for i in range(0, len(part), step):
+            chunk = part.iloc[i:i + step]
+            plates, drivers = chunk['plate'].unique().tolist(), chunk['driver'].unique().tolist()
+            if not (kept['plate'].isin(plates) & kept['driver'].isin(drivers)).any():
+                tasks.append(({"period": period}, {"plate": plates, "driver": drivers}))
+            else:
+                tasks += [({"period": period, "plate": plate}, {"driver": g['driver'].tolist()}) for plate, g in chunk.groupby('plate')]
+
+    def send(batch):
+        for eqs, ins in batch:
+            q = supabase.table("vehicle_rollups").delete()
+            for c, v in eqs.items(): q = q.eq(c, v)
+            for c, v in ins.items(): q = q.in_(c, v)
+            q.execute()
+    _run_batches(tasks, send, 1, BULK_WORKERS, lambda done, total: None)
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _rollups(period, stamp):
+    # None means "no rollups available", so callers fall back to the report functions.
+    # Without the marker row the table was never rebuilt. The period itself is paged like any table.
+    try:
+        if not supabase.table("vehicle_rollups").select("plate").eq("period", ROLLUP_MARKER['period']).limit(1).execute().data: return None
+        rows = fetch_rows("vehicle_rollups", ",".join(['plate', 'driver'] + ROLLUP_FIELDS), period=period)
+    except Exception:
+        return None
+    return pd.DataFrame(rows) if rows else None
+
+def rollups(period):
+    if rollups_stale(): return None
+    return _rollups(period, table_stamp("vehicle_rollups"))
+
+# --- 7. MILEAGE CHAIN ---
+# A log's mileage is its KM run / the liters of the PREVIOUS log of the same plate, so adding,
+# fixing or deleting one log changes the mileage of the log after it. These helpers recompute a
+# plate's chain in one pass and write back only the rows whose mileage actually changed.
+def _recompute_chain(records, anchored):
+    # anchored: plates whose first record is only the fill-up before the range (True = every plate)
+    if not records: return 0
+    logs = pd.DataFrame(records).sort_values(['plate', 'date', 'id'])
+    prev = logs.groupby('plate')['liters'].shift()
+    fresh = pd.Series(fill_mileage(logs['km_run'], prev), index=logs.index)
+    changed = (fresh - pd.to_numeric(logs['mileage'], errors='coerce')).abs().fillna(1.0) > 0.005
+    if anchored:
+        # The first row only supplies the liters; its own previous log was not loaded
+        first = logs.groupby('plate').cumcount() == 0
+        changed &= ~first if anchored is True else ~(first & logs['plate'].isin(anchored))
+    # Patch the fetched records themselves so every other column goes back untouched
+    rows = [{**records[i], "mileage": float(fresh[i])} for i in logs.index[changed]]
+    if rows:
+        bulk_upsert("logs", rows, on_conflict="id")
+        invalidate("logs"); unarchive("logs", [r['date'] for r in rows])
+    return len(rows)
+
+def recompute_mileage(plate, since):
+    """Fixes the mileage of every log of a plate dated on/after `since`. Returns how many changed."""
+    since = str(since)
+    anchor = supabase.table("logs").select("date").eq("plate", plate).lt("date", since).order("date", desc=True).limit(1).execute().data
+    return _recompute_chain(fetch_rows("logs", plate=plate, date_from=anchor[0]['date'] if anchor else None), anchored=bool(anchor))
+
+def recompute_all_mileage():
+    return _recompute_chain(fetch_rows("logs"), anchored=False)
+
+# --- 8. BULK IMPORT ---
+# Monthly statements from the fuel station / workshop as CSV or Excel. The whole file is
+# validated and priced at once, inserted with bulk_insert() and closed with ONE vehicles update per plate.
+FUEL_IMPORT_COLUMNS = ['date', 'plate', 'km_run', 'liters', 'rate_per_ltr']
+REPAIR_IMPORT_COLUMNS = ['date', 'plate', 'work_type', 'cost']
+
+def read_statement(uploaded):
+    raw = pd.read_excel(uploaded) if uploaded.name.lower().endswith(('.xlsx', '.xls')) else pd.read_csv(uploaded)
+    raw.columns = raw.columns.astype(str).str.strip().str.lower().str.replace(r'[^a-z0-9]+', '_', regex=True).str.strip('_')
+    return raw
+
+def _check_statement(raw, required, numeric, vehicles):
+    """Common validation. Returns (clean rows, list of problems)."""
+    missing = [c for c in required if c not in raw.columns]
+    if missing: return pd.DataFrame(), [f"Missing column(s): {', '.join(missing)}"]
+    rows = raw.copy()
+    rows['plate'] = rows['plate'].astype(str).str.upper().str.strip()
+    # ISO dates first; anything else (e.g. 05/03/2025 from the station) is read day-first
+    dates = pd.to_datetime(rows['date'], errors='coerce', format='ISO8601')
+    rest = dates.isna() & rows['date'].notna()
+    if rest.any(): dates[rest] = pd.to_datetime(rows.loc[rest, 'date'].astype(str), errors='coerce', format='mixed', dayfirst=True)
+    rows['date'] = dates
+    for c in numeric: rows[c] = pd.to_numeric(rows[c], errors='coerce')
+
+    known = set(vehicles['plate']) if not vehicles.empty else set()
+    checks = {"unknown plate": ~rows['plate'].isin(known), "bad date": rows['date'].isna()}
+    for c in numeric: checks[f"bad {c}"] = rows[c].isna() | (rows[c] < 0)
+    problems = []
+    bad = pd.Series(False, index=rows.index)
+    for reason, mask in checks.items():
+        if mask.any(): problems.append(f"{int(mask.sum())} row(s) with {reason} (lines {', '.join(str(i + 2) for i in rows.index[mask][:10])})")
+        bad |= mask
+    return rows[~bad], problems
+
+def _import_starts(rows):
+    # ((plate, earliest statement date), ...) in one fixed form, so prepare and import share the cache entry
+    firsts = pd.to_datetime(rows['date'], format='ISO8601').groupby(rows['plate'].astype(str)).min()
+    return tuple(sorted((p, d.strftime("%Y-%m-%d %H:%M:%S")) for p, d in firsts.items()))
+
+def plate_logs(froms, columns="*"):
+    """Logs of every (plate, first date) pair from that date on, the plates fetched in parallel."""
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        return list(chain.from_iterable(pool.map(lambda item: fetch_rows("logs", columns, plate=item[0], date_from=item[1]), froms)))
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _statement_logs(starts, stamp):
+    """(froms, logs): each plate is read from its last fill-up before the statement (froms) onwards."""
+    def anchor(item):
+        plate, since = item
+        before = supabase.table("logs").select("date").eq("plate", plate).lt("date", since).order("date", desc=True).limit(1).execute().data
+        return plate, before[0]['date'] if before else since
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        froms = tuple(pool.map(anchor, starts))
+    return froms, pd.DataFrame(plate_logs(froms, "plate,date,liters"), columns=['plate', 'date', 'liters'])
+
+def statement_logs(rows): return _statement_logs(_import_starts(rows), table_stamp("logs"))[1]
+
+def prepare_fuel_import(raw, vehicles):
+    rows, problems = _check_statement(raw, FUEL_IMPORT_COLUMNS, ['km_run', 'liters', 'rate_per_ltr'], vehicles)
+    if rows.empty: return rows, problems
+    drivers = vehicles.set_index('plate')['driver']
+    rows['driver'] = rows['driver'].fillna(rows['plate'].map(drivers)) if 'driver' in rows.columns else rows['plate'].map(drivers)
+    rows['total_cost'] = rows['liters'] * rows['rate_per_ltr']
+
+    # Mileage = KM run / liters of the PREVIOUS fill-up of that plate, existing logs included
+    old = statement_logs(rows).assign(date=lambda d: pd.to_datetime(d['date'], errors='coerce', format='ISO8601'), new=False)
+    # A bill with the same date, plate and liters as an existing log was already imported or typed in
+    seen = set(zip(old['plate'], old['date'], old['liters'].astype(float).round(2)))
+    dup = pd.Series([k in seen for k in zip(rows['plate'], rows['date'], rows['liters'].round(2))], index=rows.index, dtype=bool)
+    if dup.any():
+        problems.append(f"{int(dup.sum())} row(s) already in the fuel logs (lines {', '.join(str(i + 2) for i in rows.index[dup][:10])})")
+        rows = rows[~dup]
+        if rows.empty: return rows, problems
+    chain_df = pd.concat([old, rows.assign(new=True)], ignore_index=True).sort_values(['plate', 'date', 'new'], kind='stable')
+    prev = chain_df.groupby('plate')['liters'].shift()
+    chain_df['mileage'] = fill_mileage(chain_df['km_run'], prev)
+    rows = chain_df[chain_df['new']].drop(columns='new').astype({'km_run': int})
+    rows['date'] = rows['date'].dt.strftime("%Y-%m-%d %H:%M:%S")
+    return rows[['date', 'plate', 'driver', 'km_run', 'liters', 'mileage', 'rate_per_ltr', 'total_cost']], problems
+
+def prepare_repair_import(raw, vehicles):
+    rows, problems = _check_statement(raw, REPAIR_IMPORT_COLUMNS, ['cost'], vehicles)
+    if rows.empty: return rows, problems
+    rows['notes'] = rows['notes'].fillna("").astype(str) if 'notes' in rows.columns else ""
+    odo_now = rows['plate'].map(vehicles.set_index('plate')['odo'])
+    rows['odo'] = pd.to_numeric(rows['odo'], errors='coerce').fillna(odo_now) if 'odo' in rows.columns else odo_now
+    rows['odo'] = rows['odo'].astype(int)
+    rows['date'] = rows['date'].dt.strftime("%Y-%m-%d")
+    return rows[['date', 'plate', 'work_type', 'cost', 'notes', 'odo']], problems
+
+def import_fuel(rows, vehicles, progress=lambda done, total: None):
+    # Same cached read as prepare_fuel_import(); it runs from before each plate's earliest bill, so its max is the plate's newest log
+    starts = _import_starts(rows)
+    froms, old = _statement_logs(starts, table_stamp("logs"))
+    latest_before = old.groupby('plate')['date'].max()
+    bulk_insert("logs", rows.to_dict('records'), progress=progress)
+    apply_rollups([d for r in rows.itertuples() for d in fuel_deltas(r.plate, r.driver, r.date, r.km_run, r.liters, r.total_cost)])
+
+    # Like "Save Diesel Record": if the statement holds the NEWEST fill-up of a bus, start its next trip from it
+    newest = rows.sort_values('date').groupby('plate').tail(1)
+    odo = vehicles.set_index('plate')['odo']
+    for r in newest.itertuples():
+        if r.plate not in latest_before.index or str(r.date) > str(latest_before[r.plate]):
+            supabase.table("vehicles").update({"trip_km": int(odo[r.plate]), "fuel_liters": float(r.liters)}).eq("plate", r.plate).execute()
+    invalidate("vehicles"); invalidate("logs", appended=True); unarchive("logs", rows['date'])
+    # Back-dated bills change the mileage of the existing logs that follow them: one pass over every plate, one upsert
+    anchored = {plate for (plate, since), (_, first) in zip(starts, froms) if first != since}
+    _recompute_chain(plate_logs(froms), anchored=anchored)
+
+def import_repairs(rows, progress=lambda done, total: None):
+    bulk_insert("maintenance", rows.to_dict('records'), progress=progress)
+    apply_rollups([d for r in rows.itertuples() for d in repair_deltas(r.plate, r.date, r.cost)])
+    invalidate("maintenance", appended=True); unarchive("maintenance", rows['date'])
+
+# --- 9. MONTH-END ARCHIVE ---
+# Closed months of logs/maintenance never change after the month-end audit, so they are kept as local
+# Parquet files (archive/<table>/year=YYYY/month=MM.parquet, rows sorted by plate, zstd) and reports
+# read them memory-mapped instead of downloading the same JSON again. Supabase stays the master copy:
+# any write dated in an archived month drops that month, and the next archive run writes it again.
+# The manifest names the Supabase project the files came from; another project's archive is ignored.
+ARCHIVE_DIR = os.environ.get("AKSHARA_ARCHIVE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive")
+ARCHIVE_GRACE_DAYS = 5      # A month is closed this many days after it ends (time for the month-end audit)
+_DICT = pa.dictionary(pa.int32(), pa.string())
+ARCHIVE_SCHEMAS = {
+    "logs": pa.schema([("id", pa.int64()), ("date", pa.timestamp("s")), ("plate", _DICT), ("driver", _DICT),
+                       ("km_run", pa.int32()), ("liters", pa.float64()), ("mileage", pa.float64()),
+                       ("rate_per_ltr", pa.float64()), ("total_cost", pa.float64())]),
+    "maintenance": pa.schema([("id", pa.int64()), ("date", pa.timestamp("s")), ("plate", _DICT), ("work_type", _DICT),
+                              ("cost", pa.float64()), ("notes", pa.string()), ("odo", pa.int32())]),
+}
+
+@st.cache_resource
+def _archive():
+    project = st.secrets["SUPABASE_URL"]
+    try:
+        with open(os.path.join(ARCHIVE_DIR, "manifest.json")) as f: saved = json.load(f)
+    except:
+        saved = {}
+    tables = saved.get("tables", {}) if saved.get("project") == project else {}
+    # "touched" counts writes per month, so a month written while it was being archived is not marked done
+    return {"dir": ARCHIVE_DIR, "project": project,
+            "manifest": {t: tables.get(t, {"first": None, "months": {}}) for t in ARCHIVE_SCHEMAS},
+            "touched": {t: {} for t in ARCHIVE_SCHEMAS}, "lock": threading.Lock()}
+
+def _save_manifest(state):
+    os.makedirs(state["dir"], exist_ok=True)
+    tmp = os.path.join(state["dir"], "manifest.json.tmp")
+    with open(tmp, "w") as f: json.dump({"project": state["project"], "tables": state["manifest"]}, f, indent=1)
+    os.replace(tmp, os.path.join(state["dir"], "manifest.json"))
+
+def _partition(table, month):
+    return os.path.join(_archive()["dir"], table, f"year={month[:4]}", f"month={month[5:7]}.parquet")
+
+def unarchive(table, dates=None):
+    """Drops the archived months of `table` that contain any of `dates` (all months if None)."""
+    state = _archive()
+    with state["lock"]:
+        manifest = state["manifest"][table]
+        hit = list(manifest["months"]) if dates is None else sorted({str(d)[:7] for d in dates})
+        changed = dates is None and manifest["first"] is not None
+        if dates is None: manifest["first"] = None
+        # A row older than the first archived month starts a new, not yet archived, first month
+        elif hit and manifest["first"] and hit[0] < manifest["first"]: manifest["first"] = hit[0]; changed = True
+        for m in hit:
+            state["touched"][table][m] = state["touched"][table].get(m, 0) + 1
+            if manifest["months"].pop(m, None) is not None:
+                changed = True
+                try: os.remove(_partition(table, m))
+                except: pass
+        if changed: _save_manifest(state)
+
+def archived_months(table):
+    """The archived months that can be read: the unbroken run from the first month with data."""
+    manifest = _archive()["manifest"][table]
+    if not manifest["first"]: return []
+    months, m = [], pd.Period(manifest["first"], "M")
+    while str(m) in manifest["months"]:
+        months.append(str(m)); m += 1
+    return months
+
+def last_closed_month():
+    return str((pd.Timestamp.today() - pd.Timedelta(days=ARCHIVE_GRACE_DAYS)).to_period("M") - 1)
+
+def _archive_month(table, month):
+    state = _archive()
+    touched = state["touched"][table].get(month, 0)
+    schema = ARCHIVE_SCHEMAS[table]
+    frame = pd.DataFrame(fetch_rows(table, ",".join(schema.names), date_from=f"{month}-01",
+                                    date_to=pd.Period(month, "M").end_time.strftime("%Y-%m-%d")), columns=schema.names)
+    if not frame.empty:
+        frame['date'] = pd.to_datetime(frame['date'], errors='coerce', format='ISO8601')
+        frame = frame.sort_values(['plate', 'date', 'id'])
+        path = _partition(table, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False), path + ".tmp", compression="zstd")
+        os.replace(path + ".tmp", path)
+    with state["lock"]:
+        if state["touched"][table].get(month, 0) != touched: return 0   # Written meanwhile: try again next run
+        state["manifest"][table]["months"][month] = {"rows": len(frame), "archived": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        _save_manifest(state)
+    return len(frame)
+
+def archive_job(progress):
+    progress("Finding closed months", 0.0)
+    last, done, rows = last_closed_month(), 0, 0
+    todo = []
+    for table in ARCHIVE_SCHEMAS:
+        manifest = _archive()["manifest"][table]
+        if not manifest["first"]:
+            oldest = supabase.table(table).select("date").order("date").limit(1).execute().data
+            if not oldest: continue
+            manifest["first"] = str(oldest[0]['date'])[:7]
+        todo += [(table, str(m)) for m in pd.period_range(manifest["first"], last, freq="M") if str(m) not in manifest["months"]]
+    for i, (table, month) in enumerate(todo):
+        progress(f"Archiving {table} {month_label(month)}", i / len(todo))
+        rows += _archive_month(table, month); done += 1
+    return f"Archived {done} month(s), {rows:,} rows" if done else "Every closed month is already archived"
+
+def read_archive(table, months, columns):
+    """Archived rows of `months`, typed (date is a timestamp, plate a category)."""
+    frames = []
+    for m in months:
+        path = _partition(table, m)
+        if os.path.exists(path):
+            frames.append(pq.read_table(path, columns=columns, memory_map=True).to_pandas())
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+def history(table, columns, date_from=None, date_to=None):
+    """Rows of `table` between two dates: archived months from disk plus the live tail from Supabase."""
+    cols = columns.split(",")
+    months = archived_months(table)
+    lo = str(date_from)[:7] if date_from else None
+    hi = str(date_to)[:7] if date_to else None
+    use = [m for m in months if (lo is None or m >= lo) and (hi is None or m <= hi)]
+    if months and hi is not None and hi <= months[-1]:
+        return read_archive(table, use, cols)
+    tail_from = str(pd.Period(months[-1], "M") + 1) + "-01" if months else None
+    if date_from and (tail_from is None or str(date_from) > tail_from): tail_from = str(date_from)
+    # The open-ended tail only grows between writes, so it is kept and topped up with the new rows
+    fetch_cols = columns if 'id' in cols else columns + ",id"
+    live = load_data(table, fetch_cols, date_from=tail_from, date_to=date_to, incremental=date_to is None)
+    if 'id' not in cols and 'id' in live.columns: live = live.drop(columns='id')
+    if 'date' in live.columns: live['date'] = pd.to_datetime(live['date'], errors='coerce', format='ISO8601')
+    return pd.concat([read_archive(table, use, cols), live], ignore_index=True) if use else live
 
-# --- 3. CRASH-PROOF AUTO-BACKUP ENGINE ---
-def trigger_auto_backup(event_name):
+# --- 10. FLEET REPORTS ---
+# Report totals are computed inside Postgres (see sql/reports.sql) so only a few rows travel.
+# If a function is not installed, the same numbers are computed here from projected columns.
+@st.cache_resource
+def _missing_rpcs():
+    return {}
+
+def call_rpc(fn, params=None, strict=False):
+    # Returns None when the function is missing; it is tried again after CACHE_TTL.
+    # Any other error (timeout, dropped connection) returns None too, or is raised with strict=True.
+    missing = _missing_rpcs()
+    if time.time() - missing.get(fn, 0) < CACHE_TTL: return None
+    try:
+        return supabase.rpc(fn, params or {}).execute().data
+    except Exception as e:
+        if getattr(e, "code", None) == "PGRST202" or "Could not find the function" in str(e):
+            missing[fn] = time.time()
+            return None
+        if strict: raise
+        return None
+
+def table_stamp(*tables):
+    versions = _table_versions()
+    return tuple(versions.get(t, (0, 0)) for t in tables)
+
+def month_label(month):
+    return datetime.strptime(month, "%Y-%m").strftime("%B %Y")
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _report_months(stamp):
+    rows = call_rpc("fleet_log_months")
+    if rows is not None:
+        return [r['month'] for r in rows]
+    logs = history("logs", "date")
+    if logs.empty: return []
+    dates = logs['date'].dropna()
+    return sorted(str(m) for m in dates.dt.to_period('M').unique())
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _monthly_report(month, stamp):
+    cols = ['plate', 'driver', 'total_km', 'total_liters', 'total_cost']
+    rolled = rollups(month)
+    if rolled is not None:
+        rolled = rolled[rolled['driver'] != ""].rename(columns={'km_run': 'total_km', 'liters': 'total_liters', 'fuel_cost': 'total_cost'})
+        return rolled[cols].sort_values(['plate', 'driver']).reset_index(drop=True)
+    if month not in archived_months("logs"):
+        rows = call_rpc("fleet_monthly_report", {"p_month": month})
+        if rows is not None:
+            return pd.DataFrame(rows, columns=cols)
+    month_end = pd.Period(month, 'M').end_time.strftime("%Y-%m-%d")
+    logs = history("logs", "plate,driver,km_run,liters,total_cost", date_from=f"{month}-01", date_to=month_end)
+    if logs.empty: return pd.DataFrame(columns=cols)
+    return logs.groupby(['plate', 'driver'], observed=True).agg(
+        total_km=('km_run', 'sum'), total_liters=('liters', 'sum'), total_cost=('total_cost', 'sum')
+    ).reset_index()
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _lifetime_spend(stamp):
+    cols = ['plate', 'fuel_cost', 'repair_cost']
+    rolled = rollups("ALL")
+    if rolled is not None:
+        plates = load_data("vehicles", "plate")
+        spend = pd.DataFrame({'plate': plates['plate'].unique() if not plates.empty else []})
+        return spend.merge(rolled[cols], on='plate', how='left').fillna({'fuel_cost': 0.0, 'repair_cost': 0.0})
+    rows = call_rpc("fleet_lifetime_spend")
+    if rows is not None:
+        return pd.DataFrame(rows, columns=cols)
+    plates = load_data("vehicles", "plate")
+    if plates.empty: return pd.DataFrame(columns=cols)
+    fuel = history("logs", "plate,total_cost")
+    maint = history("maintenance", "plate,cost")
+    spend = pd.DataFrame({'plate': plates['plate'].unique()})
+    spend['fuel_cost'] = spend['plate'].map(fuel.groupby('plate', observed=True)['total_cost'].sum()).fillna(0.0) if not fuel.empty else 0.0
+    spend['repair_cost'] = spend['plate'].map(maint.groupby('plate', observed=True)['cost'].sum()).fillna(0.0) if not maint.empty else 0.0
+    return spend
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _maintenance_summary(stamp):
+    cols = ['plate', 'repairs', 'repair_cost']
+    rolled = rollups("ALL")
+    if rolled is not None:
+        return rolled.loc[rolled['repairs'] > 0, cols].reset_index(drop=True)
+    maint = history("maintenance", "plate,cost")
+    if maint.empty: return pd.DataFrame(columns=cols)
+    return maint.groupby('plate', observed=True).agg(repairs=('cost', 'count'), repair_cost=('cost', 'sum')).reset_index()
+
+# Section results, memoised per table version so a rerun of a section redoes no pandas work
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _live_fleet(stamp, queued):
+    m_df = with_pending(load_data("vehicles"))
+    if m_df.empty or 'plate' not in m_df.columns: return pd.DataFrame()
+    m_df['Trip KM'] = trip_km(m_df['odo'], m_df['trip_km'])
+    m_df['Mileage'] = live_mileage(m_df['Trip KM'], m_df['fuel_liters'])
+    display_cols_live = ['plate', 'driver', 'odo', 'Trip KM', 'Mileage']
+    if 'start_date' in m_df.columns:
+        display_cols_live.insert(2, 'start_date')
+    return m_df[display_cols_live]
+
+def live_fleet(): return _live_fleet(table_stamp("vehicles"), write_queue()["version"])
+
+def report_months(): return _report_months(table_stamp("logs"))
+def monthly_report(month): return _monthly_report(month, table_stamp("logs", "vehicle_rollups"))
+def lifetime_spend(): return _lifetime_spend(table_stamp("vehicles", "logs", "maintenance", "vehicle_rollups"))
+def maintenance_summary(): return _maintenance_summary(table_stamp("maintenance", "vehicle_rollups"))
+
+# --- 11. CRASH-PROOF AUTO-BACKUP ENGINE ---
+# A backup is either a full "base" snapshot or a "delta" holding only the rows inserted or changed
+# since the previous backup (by their updated_at, see sql/backups.sql) plus the list of ids still
+# present, so deletions replay too. Without updated_at every backup is a base.
+# Each table is gzipped JSON, base64 encoded and cut into bounded chunks in backup_chunks.
+BACKUP_TABLES = ["vehicles", "logs", "maintenance"]
+BACKUP_META_COLUMNS = "id,backup_date,event_type,kind,base_id,size_bytes,row_counts,watermarks"
+BACKUP_CHUNK_CHARS = 256_000
+BASE_EVERY_DAYS = 7       # Days a chain of deltas grows before the next base snapshot
+UPDATE_OVERLAP = pd.Timedelta(minutes=10)   # A transaction stamps updated_at when it starts, so look back a little
+
+def _pack(doc):
+    blob = base64.b64encode(gzip.compress(json.dumps(doc, separators=(",", ":")).encode('utf-8'))).decode('ascii')
+    return [blob[i:i + BACKUP_CHUNK_CHARS] for i in range(0, len(blob), BACKUP_CHUNK_CHARS)] or [""]
+
+def _unpack(slices):
+    return json.loads(gzip.decompress(base64.b64decode("".join(slices))))
+
+def _last_backup():
+    rows = supabase.table("backups").select("id,backup_date,kind,base_id,watermarks").in_("kind", ["base", "delta"]).order("id", desc=True).limit(1).execute().data
+    if not rows: return None, None
+    last = rows[0]
+    if last['kind'] == "base": return last, last['backup_date']
+    base = supabase.table("backups").select("backup_date").eq("id", last['base_id']).limit(1).execute().data
+    return last, base[0]['backup_date'] if base else None
+
+def trigger_auto_backup(event_name, progress=lambda step, done: None, full=False):
     today_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    try: v_data = supabase.table("vehicles").select("*").execute().data
-    except: v_data = []
-    try: l_data = supabase.table("logs").select("*").execute().data
-    except: l_data = []
-    try: m_data = supabase.table("maintenance").select("*").execute().data
-    except: m_data = []
-    
     try:
-        supabase.table("backups").insert({
-            "backup_date": today_str, "event_type": event_name,
-            "vehicles_data": json.dumps(v_data), "logs_data": json.dumps(l_data)
-        }).execute()
-    except: pass 
+        last, base_date = (None, None) if full else _last_backup()
+        base_age = (datetime.now() - datetime.strptime(str(base_date)[:10], "%Y-%m-%d")).days if base_date else None
+        # {table: newest updated_at seen}; a table without one (column missing, older backup) forces a base
+        marks = {} if last is None else dict((last.get('watermarks') or {}).get("updated_at") or {})
+        is_base = (last is None or base_age is None or base_age >= BASE_EVERY_DAYS
+                   or any(t not in marks for t in BACKUP_TABLES if t != "vehicles"))
+        if is_base: marks = {}
+        started = pd.Timestamp.now(tz="UTC")
+
+        docs, counts = {}, {}
+        for i, t in enumerate(BACKUP_TABLES):
+            progress(f"Reading {t}", 0.1 + 0.5 * i / len(BACKUP_TABLES))
+            if is_base or t == "vehicles":
+                docs[t] = {"rows": fetch_rows(t)}
+            else:
+                since = (pd.Timestamp(marks[t]) - UPDATE_OVERLAP).isoformat()
+                docs[t] = {"rows": fetch_rows(t, updated_since=since),
+                           "ids": [r['id'] for r in fetch_rows(t, "id")]}
+            stamps = [r['updated_at'] for r in docs[t]["rows"] if r.get('updated_at')]
+            if t != "vehicles" and stamps:
+                newest = pd.to_datetime(stamps, utc=True, format='ISO8601').max()
+                marks[t] = max(newest, pd.Timestamp(marks[t])).isoformat() if t in marks else newest.isoformat()
+            elif t != "vehicles" and t not in marks and not docs[t]["rows"]:
+                # An empty table still gets a mark (this backup's start), as long as it has the column
+                try:
+                    supabase.table(t).select("updated_at").limit(1).execute()
+                    marks[t] = started.isoformat()
+                except Exception:
+                    pass
+            counts[t] = len(docs[t]["rows"])
+        watermarks = {"updated_at": marks}
+
+        progress("Compressing", 0.65)
+        packed = {t: _pack(doc) for t, doc in docs.items()}
+        meta = supabase.table("backups").insert({
+            "backup_date": today_str, "event_type": event_name, "kind": "base" if is_base else "delta",
+            "base_id": None if is_base else (last['id'] if last['kind'] == "base" else last['base_id']),
+            "watermarks": watermarks, "row_counts": counts,
+            "size_bytes": sum(len(c) for slices in packed.values() for c in slices)
+        }).execute().data[0]
+
+        chunks = [(t, seq, c) for t, slices in packed.items() for seq, c in enumerate(slices)]
+        try:
+            for n, (t, seq, c) in enumerate(chunks):
+                progress("Saving backup", 0.7 + 0.3 * n / len(chunks))
+                supabase.table("backup_chunks").insert({"backup_id": meta['id'], "table_name": t, "seq": seq, "payload": c}).execute()
+        except Exception:
+            # Never leave a half-written backup behind (chunks cascade-delete with it)
+            supabase.table("backups").delete().eq("id", meta['id']).execute()
+            raise
+        invalidate("backups", appended=True)
+        return True
+    except:
+        return False
+
+def restorable(kind, watermarks):
+    # Deltas taken before updated_at tracking only hold NEW rows, so edits to older rows are missing
+    return kind != "delta" or "updated_at" in (watermarks if isinstance(watermarks, dict) else {})
+
+def backup_state(backup_id):
+    """Rebuilds {table: rows} exactly as they were when the given backup was taken."""
+    target = supabase.table("backups").select("id,kind,base_id").eq("id", int(backup_id)).limit(1).execute().data[0]
+    if target.get('kind') not in ("base", "delta"):
+        # Old single-row backups: vehicles and logs stored as JSON text, no repairs
+        old = supabase.table("backups").select("vehicles_data,logs_data").eq("id", int(backup_id)).limit(1).execute().data[0]
+        return {"vehicles": json.loads(old['vehicles_data'] or "[]"), "logs": json.loads(old['logs_data'] or "[]"), "maintenance": None}
+
+    base_id = target['id'] if target['kind'] == "base" else target['base_id']
+    chain = [base_id] + [r['id'] for r in supabase.table("backups").select("id").eq("base_id", base_id).lte("id", target['id']).order("id").execute().data]
+    state = {}
+    for b_id in chain:
+        chunks = pd.DataFrame(supabase.table("backup_chunks").select("table_name,seq,payload").eq("backup_id", b_id).execute().data)
+        for t, part in chunks.sort_values("seq").groupby("table_name"):
+            doc = _unpack(part['payload'].tolist())
+            if t == "vehicles" or "ids" not in doc:
+                state[t] = {r.get('id', r.get('plate')): r for r in doc["rows"]}
+            else:
+                kept = state.get(t, {})
+                state[t] = {i: kept[i] for i in doc["ids"] if i in kept}
+                state[t].update({r['id']: r for r in doc["rows"]})
+    return {t: list(state.get(t, {}).values()) for t in BACKUP_TABLES}
+
+def restore_backup(backup_id, progress=lambda step, done: None):
+    """Puts every table back to the given backup: bulk-upserts its rows and bulk-deletes rows that were added later."""
+    progress("Reading backup", 0.05)
+    state = backup_state(backup_id)
+    for i, t in enumerate(BACKUP_TABLES):
+        rows = state[t]
+        if rows is None: continue
+        key = ORDER_KEYS.get(t, "id")
+        progress(f"Restoring {t}", 0.1 + 0.8 * i / len(BACKUP_TABLES))
+        keep = {r[key] for r in rows}
+        bulk_delete(t, key, [r[key] for r in fetch_rows(t, key) if r[key] not in keep])
+        bulk_upsert(t, rows, on_conflict=key)
+    call_rpc("reset_id_sequences")
+    invalidate(*BACKUP_TABLES)
+    for t in ARCHIVE_SCHEMAS: unarchive(t)
+    progress("Rebuilding totals", 0.95)
+    try: rebuild_rollups()
+    except: pass
+
+def backup_exists_today():
+    # Indexed range lookup on backup_date (sql/backups.sql) instead of downloading every backup
+    today = datetime.now().strftime("%Y-%m-%d")
+    rows = supabase.table("backups").select("id").gte("backup_date", today).lte("backup_date", f"{today} 23:59:59").limit(1).execute().data
+    return bool(rows)
+
+# Background jobs run on ONE worker thread for the whole server. Jobs from every session queue up
+# behind each other, and a job that is already queued or running is not queued a second time.
+@st.cache_resource
+def _job_worker():
+    return {"pool": ThreadPoolExecutor(max_workers=1, thread_name_prefix="akshara-jobs"), "lock": threading.Lock(),
+            "queued": set(), "status": {"job": "", "state": "idle", "step": "", "progress": 0.0, "finished": "", "error": ""}}
+
+def job_status():
+    return dict(_job_worker()["status"])
+
+def submit_job(name, fn):
+    """Runs fn(progress) in the background. Returns False if the same job is already queued or running."""
+    worker = _job_worker()
+    ctx = get_script_run_ctx()
+    with worker["lock"]:
+        if name in worker["queued"]: return False
+        worker["queued"].add(name)
+
+    def progress(step, done):
+        worker["status"].update(step=step, progress=done)
+
+    def run():
+        # Borrow the submitting session's context so the shared caches can be used from this thread
+        add_script_run_ctx(threading.current_thread(), ctx)
+        job_run = perf_start("job", name) if PERF["enabled"] else None
+        worker["status"].update(job=name, state="running", step="Starting", progress=0.0, error="")
+        try:
+            result = fn(progress)
+            worker["status"].update(state="done", step=result or "Finished", progress=1.0)
+        except Exception as e:
+            worker["status"].update(state="failed", error=str(e))
+        finally:
+            worker["status"]["finished"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            with worker["lock"]: worker["queued"].discard(name)
+            perf_lap("job"); perf_finish(job_run)
+            add_script_run_ctx(threading.current_thread(), None)
+
+    worker["pool"].submit(run)
+    return True
+
+def daily_backup_job(progress):
+    progress("Checking today's backup", 0.05)
+    if backup_exists_today(): return "Today's backup already exists"
+    if not trigger_auto_backup("Daily Auto-Backup", progress): raise Exception("Backup could not be saved")
+    return "Daily backup saved"
+
+def manual_backup_job(progress):
+    if not trigger_auto_backup("Manual Backup", progress): raise Exception("Backup could not be saved")
+    return "Backup saved"
+
+def factory_wipe_job(progress):
+    if not trigger_auto_backup("Emergency Backup before Factory Wipe", lambda step, done: progress(step, done * 0.5), full=True):
+        raise Exception("Emergency backup failed, so NOTHING was erased")
+    for i, t in enumerate(["vehicles", "logs", "maintenance"]):
+        bulk_wipe(t, lambda done, total: progress(f"Erasing {t} ({done}/{total})", 0.5 + 0.15 * i + 0.15 * done / max(total, 1)))
+    invalidate("vehicles", "logs", "maintenance")
+    progress("Erasing vehicle totals", 0.95)
+    try: bulk_wipe("vehicle_rollups")
+    except: pass
+    for t in ARCHIVE_SCHEMAS: unarchive(t)
+    try: rebuild_rollups()
+    except: pass
+    return "FACTORY RESET COMPLETE!"
+
+def restore_job(backup_id):
+    def run(progress):
+        if not trigger_auto_backup("Backup before Restore", lambda step, done: progress(step, done * 0.3), full=True):
+            raise Exception("Safety backup failed, so NOTHING was restored")
+        restore_backup(backup_id, lambda step, done: progress(step, 0.3 + done * 0.7))
+        return f"Restored backup #{backup_id}"
+    return run
+
+def job_status_panel():
+    status = job_status()
+    if status["state"] == "idle": return
+    if status["state"] == "running":
+        st.progress(status["progress"], text=f"☁️ {status['job']}: {status['step']}")
+    elif status["state"] == "failed":
+        st.error(f"⚠️ {status['job']} failed at {status['finished']}: {status['error']}")
+    else:
+        st.caption(f"✅ {status['job']}: {status['step']} ({status['finished']})")
+    # Once a job finishes, rerun the whole page once so it shows the new data
+    if status["state"] != "running" and st.session_state.get("seen_job_finish") != status["finished"]:
+        first_look = "seen_job_finish" not in st.session_state
+        st.session_state.seen_job_finish = status["finished"]
+        if not first_look: st.rerun(scope="app")
+
+# --- 12. CORRECTION SEARCH ---
+# The Correction Center searches one page at a time on the (plate, date) index and only loads
+# the full record that was picked, instead of putting every row of a table into one selectbox.
+SEARCH_PAGE = 25
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _search_page(table_name, columns, plate, date_from, date_to, amount_col, amount_min, amount_max, page, stamp):
+    q = supabase.table(table_name).select(columns, count="exact")
+    if plate: q = q.eq("plate", plate)
+    if date_from: q = q.gte("date", str(date_from))
+    if date_to: q = q.lte("date", f"{date_to} 23:59:59")
+    if amount_min is not None: q = q.gte(amount_col, amount_min)
+    if amount_max is not None: q = q.lte(amount_col, amount_max)
+    res = q.order("date", desc=True).order("id", desc=True).range(page * SEARCH_PAGE, (page + 1) * SEARCH_PAGE - 1).execute()
+    return res.data, res.count or 0
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _fetch_record(table_name, record_id, stamp):
+    rows = supabase.table(table_name).select("*").eq("id", int(record_id)).limit(1).execute().data
+    return rows[0] if rows else None
+
+def record_search(table_name, columns, amount_col, amount_label, label, key):
+    """Search filters + one page of results. Returns the full picked record, or None."""
+    c1, c2, c3 = st.columns(3)
+    plates = fleet["plates"]
+    plate = c1.selectbox("Bus", ["All Buses"] + plates, key=f"{key}_plate")
+    date_from = c2.date_input("From Date", value=None, key=f"{key}_from")
+    date_to = c3.date_input("To Date", value=None, key=f"{key}_to")
+    c4, c5, c6 = st.columns(3)
+    amount_min = c4.number_input(f"Min {amount_label}", min_value=0.0, value=None, key=f"{key}_min")
+    amount_max = c5.number_input(f"Max {amount_label}", min_value=0.0, value=None, key=f"{key}_max")
+    page = c6.number_input("Page", min_value=1, value=1, key=f"{key}_page") - 1
+
+    try:
+        rows, total = _search_page(table_name, columns, None if plate == "All Buses" else plate, date_from, date_to,
+                                   amount_col, amount_min, amount_max, int(page), table_stamp(table_name))
+    except Exception as e:
+        st.error(f"Search failed: {e}"); return None
+    if not rows:
+        st.info("No matching entries."); return None
+
+    st.caption(f"{total} matching entries. Showing {page * SEARCH_PAGE + 1}-{page * SEARCH_PAGE + len(rows)}, newest first.")
+    by_id = {r['id']: r for r in rows}
+    picked = st.selectbox("Select Entry to Fix", list(by_id), format_func=lambda i: label(by_id[i]), key=f"{key}_entry")
+    return _fetch_record(table_name, picked, table_stamp(table_name))
+
+# --- 13. HISTORY GRIDS & EXPORT ---
+# History tables show one sorted page fetched from Supabase. Exports are only built when the
+# download is clicked; the CSV is fetched PAGE_SIZE rows at a time and handed over as one bytes object.
+HISTORY_PAGE_SIZES = [25, 50, 100, 250]
+FUEL_HISTORY_COLUMNS = {'date': 'Date', 'plate': 'Plate No', 'driver': 'Driver', 'km_run': 'Trip KM', 'liters': 'Diesel (L)',
+                        'mileage': 'Mileage (km/l)', 'rate_per_ltr': 'Rate (₹)', 'total_cost': 'Total Cost (₹)'}
+REPAIR_HISTORY_COLUMNS = {'date': 'Date', 'plate': 'Plate No', 'work_type': 'Type of Work', 'cost': 'Cost (₹)', 'notes': 'Details', 'odo': 'Odometer'}
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def _history_page(table_name, columns, plate, sort_col, descending, page, page_size, stamp):
+    q = supabase.table(table_name).select(columns, count="exact")
+    if plate: q = q.eq("plate", plate)
+    res = q.order(sort_col, desc=descending).order("id", desc=descending).range(page * page_size, (page + 1) * page_size - 1).execute()
+    return pd.DataFrame(res.data, columns=columns.split(",")), res.count or 0
+
+def stream_csv(table_name, names, plate=None, sort_col="date", descending=True):
+    """Yields the export as CSV bytes, one fetched page at a time."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(names.values())
+    start = 0
+    while True:
+        q = supabase.table(table_name).select(",".join(names))
+        if plate: q = q.eq("plate", plate)
+        rows = q.order(sort_col, desc=descending).order("id", desc=descending).range(start, start + PAGE_SIZE - 1).execute().data
+        writer.writerows([r.get(c) for c in names] for r in rows)
+        yield buf.getvalue().encode('utf-8')
+        buf.seek(0); buf.truncate()
+        if not rows: return
+        start += len(rows)
 
-# --- 4. LOGIN GATE ---
+def history_grid(table_name, names, formats, key, plate=None, file_name="Akshara_History.csv"):
+    c1, c2, c3, c4 = st.columns(4)
+    sort_col = c1.selectbox("Sort by", list(names), format_func=names.get, key=f"{key}_sort")
+    descending = c2.selectbox("Order", ["Newest / Highest first", "Oldest / Lowest first"], key=f"{key}_order") == "Newest / Highest first"
+    page_size = c3.selectbox("Rows per page", HISTORY_PAGE_SIZES, key=f"{key}_size")
+    page = c4.number_input("Page", min_value=1, value=1, key=f"{key}_page") - 1
+    try:
+        frame, total = _history_page(table_name, "id," + ",".join(names), plate, sort_col, descending, int(page), page_size, table_stamp(table_name))
+    except Exception as e:
+        st.error(f"Could not load history: {e}"); return
+    if frame.empty:
+        st.info("No entries on this page."); return
+
+    st.dataframe(frame[list(names)].rename(columns=names).style.format(formats, na_rep=""), use_container_width=True, hide_index=True)
+    st.caption(f"{total} entries. Showing {page * page_size + 1}-{page * page_size + len(frame)}.")
+    st.download_button("📥 Download Full History (CSV)", data=lambda: b"".join(stream_csv(table_name, names, plate, sort_col, descending)),
+                       file_name=file_name, mime="text/csv", on_click="ignore", key=f"{key}_csv")
+
+# --- 14. LOGIN GATE ---
 if 'logged_in' not in st.session_state:
     st.markdown('<div style="background-color:#FFD700;padding:15px;border-radius:15px;margin-bottom:20px;"><h1 style="color:#000080;text-align:center;">🚌 AKSHARA PUBLIC SCHOOL</h1></div>', unsafe_allow_html=True)
     user_input = st.text_input("👤 Enter Username").upper().strip()
@@ -50,56 +1287,50 @@ if 'logged_in' not in st.session_state:
         if st.button("Login as Manager"):
             if password == "Akshara@2026": 
                 st.session_state.role = "manager"; st.session_state.logged_in = True
-                today_date = datetime.now().strftime("%Y-%m-%d")
-                backups_df = load_data("backups")
-                if backups_df.empty or not backups_df['backup_date'].astype(str).str.contains(today_date).any():
-                    trigger_auto_backup("Daily Auto-Backup")
+                submit_job("Daily Auto-Backup", daily_backup_job)
+                submit_job("Month-End Archive", archive_job)
                 st.rerun()
             else:
                 st.error("❌ Invalid Password")
     else:
         if st.button("Login as Driver"):
-            if not df.empty and 'driver' in df.columns and user_input in df['driver'].str.upper().str.strip().values:
+            if user_input in fleet["by_driver"]:
                 st.session_state.role = "driver"; st.session_state.user = user_input; st.session_state.logged_in = True; st.rerun()
             else:
                 st.error("❌ Driver not found in fleet.")
+    perf_lap("login")
     st.stop()
 
-# --- 5. MANAGER DASHBOARD ---
+# --- 15. MANAGER DASHBOARD ---
 if st.session_state.role == "manager":
     st.markdown('<h2 style="color:#000080;text-align:center;">🏆 Manager Dashboard</h2>', unsafe_allow_html=True)
     
-    t1, t2, t3, t4, t5, t6, t7 = st.tabs(["📊 Live", "⛽ Log Fuel", "📅 Monthly", "🔧 Maintenance", "✏️ Corrections", "☁️ Backups", "🚨 DANGER"])
+    # Only the section on screen runs, so typing in one form never reloads or recomputes the others
+    section = st.radio("Section", ["📊 Live", "⛽ Log Fuel", "📅 Monthly", "🔧 Maintenance", "✏️ Corrections", "☁️ Backups", "🚨 DANGER", "🩺 Diagnostics"],
+                       horizontal=True, label_visibility="collapsed", key="mgr_section")
+    perf_label(section)
     
     # 1. LIVE FLEET
-    with t1:
-        if not df.empty and 'plate' in df.columns:
-            m_df = df.copy()
-            m_df['Trip KM'] = m_df['odo'] - m_df['trip_km']
-            m_df['Mileage'] = m_df.apply(lambda x: round(x['Trip KM'] / float(x['fuel_liters']), 2) if float(x['fuel_liters']) > 0 else 0.0, axis=1)
-            
+    if section == "📊 Live":
+        live_df = live_fleet()
+        if not live_df.empty:
             def style_mileage(v): return 'color: green; font-weight: bold' if float(v) > 12 else 'color: red'
-            
-            display_cols_live = ['plate', 'driver', 'odo', 'Trip KM', 'Mileage']
-            if 'start_date' in m_df.columns:
-                display_cols_live.insert(2, 'start_date')
-                
-            st.dataframe(m_df[display_cols_live].style.format({"Mileage": "{:.2f}"}).map(style_mileage, subset=['Mileage']), use_container_width=True, hide_index=True)
+            st.dataframe(live_df.style.format({"Mileage": "{:.2f}"}).map(style_mileage, subset=['Mileage']), use_container_width=True, hide_index=True)
         else:
             st.info("Fleet is empty. Please add a vehicle.")
 
     # 2. LOG FUEL 
-    with t2:
+    if section == "⛽ Log Fuel":
         st.subheader("⛽ Log Diesel Fill-up")
         st.write("Drivers update the meter on their phones. You enter the diesel bills here.")
 
-        if not df.empty and 'plate' in df.columns:
-            f_plate = st.selectbox("Select Bus to Log Fuel", df['plate'].unique(), key="log_fuel_plate")
-            f_v_data = df[df['plate'] == f_plate].iloc[0]
+        if fleet["plates"]:
+            f_plate = st.selectbox("Select Bus to Log Fuel", fleet["plates"], key="log_fuel_plate")
+            f_v_data = fleet["by_plate"][f_plate]
 
             f_driver = f_v_data['driver']
             f_current_odo = int(f_v_data['odo'])
-            f_trip_km = f_current_odo - int(f_v_data['trip_km'])
+            f_trip_km = int(trip_km(f_current_odo, f_v_data['trip_km']))
             
             # Grab the liters filled PREVIOUSLY from the database
             prev_liters = float(f_v_data['fuel_liters'])
@@ -118,7 +1349,7 @@ if st.session_state.role == "manager":
                     f_cost = f_liters * f_rate
                     
                     # --- NEW MATH: KM Run / PREVIOUS Liters ---
-                    f_mil = round(f_manual_km / prev_liters, 2) if prev_liters > 0 else 0.0
+                    f_mil = float(fill_mileage(f_manual_km, prev_liters))
                     
                     try:
                         log_payload = {
@@ -134,6 +1365,8 @@ if st.session_state.role == "manager":
                         supabase.table("vehicles").update({
                             "trip_km": f_current_odo, "fuel_liters": float(f_liters)
                         }).eq("plate", f_plate).execute()
+                        invalidate("vehicles"); invalidate("logs", appended=True); unarchive("logs", [log_payload["date"]])
+                        apply_rollups(fuel_deltas(f_plate, f_driver, log_payload["date"], f_manual_km, f_liters, f_cost))
 
                         st.success(f"✅ Fuel logged successfully! Mileage: {f_mil} km/l | Total Cost: ₹{f_cost:,.2f}"); st.rerun()
                     except Exception as e:
@@ -144,46 +1377,34 @@ if st.session_state.role == "manager":
             st.info("No vehicles in the fleet.")
     
     # 3. MONTHLY SHEET & TOTAL SPEND & DETAILED HISTORY
-    with t3:
+    if section == "📅 Monthly":
         st.subheader("📅 Monthly Diesel Sheet")
-        logs_df = load_data("logs")
-        if not logs_df.empty and 'date' in logs_df.columns:
-            logs_df['date'] = pd.to_datetime(logs_df['date'], errors='coerce')
-            logs_df = logs_df.dropna(subset=['date']) 
-            logs_df['Month_Year'] = logs_df['date'].dt.strftime('%B %Y')
+        available_months = report_months()
+        if available_months:
+            selected_month = st.selectbox("🎯 Select Month to View:", available_months, format_func=month_label)
+            report = monthly_report(selected_month)
             
-            available_months = logs_df['Month_Year'].unique().tolist()
-            if available_months:
-                selected_month = st.selectbox("🎯 Select Month to View:", available_months)
-                filtered_logs = logs_df[logs_df['Month_Year'] == selected_month]
+            if not report.empty:
+                grand_total_cost = report['total_cost'].sum()
+                grand_total_liters = report['total_liters'].sum()
+                grand_total_km = int(report['total_km'].sum())
                 
-                if not filtered_logs.empty:
-                    grand_total_cost = filtered_logs['total_cost'].sum() if 'total_cost' in filtered_logs.columns else 0
-                    grand_total_liters = filtered_logs['liters'].sum()
-                    grand_total_km = filtered_logs['km_run'].sum() if 'km_run' in filtered_logs.columns else 0
-                    
-                    c1, c2, c3 = st.columns(3)
-                    c1.metric("💰 Total Cost", f"₹ {grand_total_cost:,.2f}")
-                    c2.metric("🛢️ Total Diesel", f"{grand_total_liters:,.2f} L")
-                    c3.metric("🛣️ Total KM Run", f"{grand_total_km} km")
-                    st.divider()
-
-                    report = filtered_logs.groupby(['plate', 'driver']).agg(
-                        Total_KM=('km_run', 'sum'),
-                        Total_Liters=('liters', 'sum'),
-                        Total_Cost=('total_cost', 'sum')
-                    ).reset_index()
-                    
-                    report['Monthly Mileage'] = report.apply(lambda x: round(x['Total_KM'] / x['Total_Liters'], 2) if x['Total_Liters'] > 0 else 0, axis=1)
-                    report.rename(columns={'Total_KM': 'Total KM', 'Total_Liters': 'Total Diesel (L)', 'Total_Cost': 'Total Cost (₹)'}, inplace=True)
-                    
-                    display_cols = ['plate', 'driver', 'Total KM', 'Total Diesel (L)', 'Monthly Mileage', 'Total Cost (₹)']
-                    st.dataframe(report[display_cols], use_container_width=True, hide_index=True)
-                    
-                    csv = report[display_cols].to_csv(index=False).encode('utf-8')
-                    st.download_button("📥 Download This Month", data=csv, file_name=f"Akshara_Fleet_{selected_month}.csv", mime="text/csv")
-            else:
-                st.info("No valid dates found in logs.")
+                c1, c2, c3 = st.columns(3)
+                c1.metric("💰 Total Cost", f"₹ {grand_total_cost:,.2f}")
+                c2.metric("🛢️ Total Diesel", f"{grand_total_liters:,.2f} L")
+                c3.metric("🛣️ Total KM Run", f"{grand_total_km} km")
+                st.divider()
+
+                report = report.rename(columns={'total_km': 'Total_KM', 'total_liters': 'Total_Liters', 'total_cost': 'Total_Cost'})
+                report['Monthly Mileage'] = monthly_mileage(report['Total_KM'], report['Total_Liters'])
+                report['Cost per KM (₹)'] = cost_per_km(report['Total_Cost'], report['Total_KM'])
+                report.rename(columns={'Total_KM': 'Total KM', 'Total_Liters': 'Total Diesel (L)', 'Total_Cost': 'Total Cost (₹)'}, inplace=True)
+                
+                display_cols = ['plate', 'driver', 'Total KM', 'Total Diesel (L)', 'Monthly Mileage', 'Total Cost (₹)', 'Cost per KM (₹)']
+                st.dataframe(report[display_cols], use_container_width=True, hide_index=True)
+                
+                csv = report[display_cols].to_csv(index=False).encode('utf-8')
+                st.download_button("📥 Download This Month", data=csv, file_name=f"Akshara_Fleet_{month_label(selected_month)}.csv", mime="text/csv")
         else:
             st.info("No fuel logs recorded yet.")
 
@@ -191,22 +1412,11 @@ if st.session_state.role == "manager":
         st.divider()
         st.subheader("💰 Lifetime Total Spend by Vehicle (Fuel + Repairs)")
         
-        maint_df_all = load_data("maintenance")
-        spend_data = []
-        
-        if not df.empty and 'plate' in df.columns:
-            for p in df['plate'].unique():
-                f_cost = logs_df[logs_df['plate'] == p]['total_cost'].sum() if (not logs_df.empty and 'total_cost' in logs_df.columns and 'plate' in logs_df.columns) else 0
-                m_cost = maint_df_all[maint_df_all['plate'] == p]['cost'].sum() if (not maint_df_all.empty and 'cost' in maint_df_all.columns and 'plate' in maint_df_all.columns) else 0
-                total = f_cost + m_cost
-                spend_data.append({
-                    "Plate No": p, 
-                    "Total Fuel Cost (₹)": f_cost, 
-                    "Total Repair Cost (₹)": m_cost, 
-                    "GRAND TOTAL SPEND (₹)": total
-                })
-            
-            spend_df = pd.DataFrame(spend_data).sort_values(by="GRAND TOTAL SPEND (₹)", ascending=False)
+        spend_df = lifetime_spend()
+        if not spend_df.empty:
+            spend_df = spend_df.rename(columns={'plate': 'Plate No', 'fuel_cost': 'Total Fuel Cost (₹)', 'repair_cost': 'Total Repair Cost (₹)'})
+            spend_df['GRAND TOTAL SPEND (₹)'] = spend_df['Total Fuel Cost (₹)'] + spend_df['Total Repair Cost (₹)']
+            spend_df = spend_df.sort_values(by="GRAND TOTAL SPEND (₹)", ascending=False)
             st.dataframe(spend_df.style.format({
                 "Total Fuel Cost (₹)": "{:,.2f}",
                 "Total Repair Cost (₹)": "{:,.2f}",
@@ -216,39 +1426,19 @@ if st.session_state.role == "manager":
         # DETAILED FUEL HISTORY 
         st.divider()
         st.subheader("🧾 Detailed Fuel Fill-up History")
-        if not logs_df.empty and 'date' in logs_df.columns:
-            hist_plate = st.selectbox("🔍 Filter History by Vehicle:", ["All Vehicles"] + list(logs_df['plate'].unique()), key="hist_filter")
-            
-            history_df = logs_df.sort_values(by="date", ascending=False)
-            if hist_plate != "All Vehicles":
-                history_df = history_df[history_df['plate'] == hist_plate]
-                
-            display_hist = history_df[['date', 'plate', 'driver', 'km_run', 'liters', 'mileage', 'rate_per_ltr', 'total_cost']].copy()
-            display_hist.rename(columns={
-                'date': 'Date', 'plate': 'Plate No', 'driver': 'Driver', 'km_run': 'Trip KM',
-                'liters': 'Diesel (L)', 'mileage': 'Mileage (km/l)', 'rate_per_ltr': 'Rate (₹)', 'total_cost': 'Total Cost (₹)'
-            }, inplace=True)
-            
-            st.dataframe(display_hist.style.format({
-                "Diesel (L)": "{:.2f}",
-                "Mileage (km/l)": "{:.2f}",
-                "Rate (₹)": "{:.2f}",
-                "Total Cost (₹)": "{:.2f}"
-            }), use_container_width=True, hide_index=True)
-            
-            csv_hist = display_hist.to_csv(index=False).encode('utf-8')
-            st.download_button("📥 Download Detailed History", data=csv_hist, file_name=f"Akshara_Fuel_History_{hist_plate}.csv", mime="text/csv")
-        else:
-            st.info("No fuel logs recorded yet.")
+        hist_plates = fleet["plates"]
+        hist_plate = st.selectbox("🔍 Filter History by Vehicle:", ["All Vehicles"] + hist_plates, key="hist_filter")
+        history_grid("logs", FUEL_HISTORY_COLUMNS, {"Diesel (L)": "{:.2f}", "Mileage (km/l)": "{:.2f}", "Rate (₹)": "{:.2f}", "Total Cost (₹)": "{:.2f}"},
+                     "fuel_hist", plate=None if hist_plate == "All Vehicles" else hist_plate, file_name=f"Akshara_Fuel_History_{hist_plate}.csv")
 
 
     # 4. MAINTENANCE
-    with t4:
+    if section == "🔧 Maintenance":
         st.subheader("🔧 Maintenance & Repairs Log")
         with st.expander("➕ Log New Repair or Service"):
-            if not df.empty and 'plate' in df.columns:
-                m_plate = st.selectbox("Select Bus", df['plate'].unique(), key="maint_plate")
-                current_v_odo = int(df[df['plate'] == m_plate]['odo'].values[0])
+            if fleet["plates"]:
+                m_plate = st.selectbox("Select Bus", fleet["plates"], key="maint_plate")
+                current_v_odo = int(fleet["by_plate"][m_plate]['odo'])
                 
                 c1, c2 = st.columns(2)
                 m_date = c1.date_input("Date of Service", datetime.today(), key="maint_date") 
@@ -265,40 +1455,39 @@ if st.session_state.role == "manager":
                         "plate": m_plate, "date": m_date.strftime("%Y-%m-%d"), "work_type": m_type,
                         "cost": float(m_cost), "notes": m_notes, "odo": int(m_odo)
                     }).execute()
+                    invalidate("maintenance", appended=True); unarchive("maintenance", [m_date])
+                    apply_rollups(repair_deltas(m_plate, m_date, m_cost))
                     st.success("Repair Logged!"); st.rerun()
             else:
                 st.info("No vehicles in the fleet to log maintenance for.")
         
         st.divider()
         st.write("### 📜 Fleet Maintenance Dashboard")
-        maint_df = load_data("maintenance")
+        maint_summary = maintenance_summary()
         
-        if not maint_df.empty and 'cost' in maint_df.columns:
-            grand_total_maint = maint_df['cost'].sum()
+        if not maint_summary.empty:
+            grand_total_maint = maint_summary['repair_cost'].sum()
             st.metric("🛠️ Total Fleet Maintenance Cost", f"₹ {grand_total_maint:,.2f}")
             
             st.write("#### 🚌 Vehicle-Wise Maintenance Sheet")
-            maint_summary = maint_df.groupby('plate').agg(
-                Total_Repairs=('work_type', 'count'), Total_Cost=('cost', 'sum')
-            ).reset_index()
-            maint_summary.rename(columns={'plate': 'Plate No', 'Total_Repairs': 'Number of Services', 'Total_Cost': 'Total Cost (₹)'}, inplace=True)
+            maint_summary = maint_summary.rename(columns={'plate': 'Plate No', 'repairs': 'Number of Services', 'repair_cost': 'Total Cost (₹)'})
             maint_summary = maint_summary.sort_values(by="Total Cost (₹)", ascending=False)
             st.dataframe(maint_summary, use_container_width=True, hide_index=True)
             
             st.divider()
             st.write("#### 🧾 Detailed Repair History")
-            st.dataframe(maint_df[['date', 'plate', 'work_type', 'cost', 'notes', 'odo']].sort_values(by="date", ascending=False), use_container_width=True, hide_index=True)
+            history_grid("maintenance", REPAIR_HISTORY_COLUMNS, {"Cost (₹)": "{:,.2f}"}, "repair_hist", file_name="Akshara_Repair_History.csv")
         else:
             st.info("No maintenance records logged yet.")
 
     # 5. MANAGER CORRECTION CENTER
-    with t5:
+    if section == "✏️ Corrections":
         st.subheader("✏️ Data Correction Center")
         
         with st.expander("📝 Add Missed Fuel Record (Manager Entry)"):
-            if not df.empty and 'plate' in df.columns:
-                man_plate = st.selectbox("Select Bus", df['plate'].unique(), key="man_fuel_plate")
-                man_driver = df[df['plate'] == man_plate]['driver'].values[0]
+            if fleet["plates"]:
+                man_plate = st.selectbox("Select Bus", fleet["plates"], key="man_fuel_plate")
+                man_driver = fleet["by_plate"][man_plate]['driver']
                 
                 c1, c2 = st.columns(2)
                 man_date = c1.date_input("Date of Fill-up", datetime.today(), key="missed_fuel_date")
@@ -312,22 +1501,17 @@ if st.session_state.role == "manager":
                     if man_liters > 0 and man_rate > 0:
                         man_cost = man_liters * man_rate
                         
-                        # Fetch the liters filled EXACTLY before this manual date to use for math
-                        try:
-                            prev_log = supabase.table("logs").select("liters").eq("plate", man_plate).lt("date", man_date.strftime("%Y-%m-%d %H:%M:%S")).order("date", desc=True).limit(1).execute().data
-                            prev_liters_man = float(prev_log[0]['liters']) if prev_log else 0.0
-                        except:
-                            prev_liters_man = 0.0
-                            
-                        man_mil = round(man_km / prev_liters_man, 2) if prev_liters_man > 0 else 0.0
-                        
                         try:
+                            # Mileage is filled in by recompute_mileage(), which also fixes the NEXT log of this bus
                             supabase.table("logs").insert({
                                 "plate": man_plate, "driver": man_driver, "km_run": int(man_km),
-                                "liters": float(man_liters), "mileage": float(man_mil),
+                                "liters": float(man_liters), "mileage": 0.0,
                                 "rate_per_ltr": float(man_rate), "total_cost": float(man_cost),
                                 "date": man_date.strftime("%Y-%m-%d %H:%M:%S")
                             }).execute()
+                            invalidate("logs", appended=True); unarchive("logs", [man_date])
+                            apply_rollups(fuel_deltas(man_plate, man_driver, man_date, man_km, man_liters, man_cost))
+                            recompute_mileage(man_plate, man_date.strftime("%Y-%m-%d %H:%M:%S"))
                             st.success(f"Fuel log added for {man_plate} on {man_date}!"); st.rerun()
                         except Exception as e:
                             st.error(f"Error saving: {e}")
@@ -355,43 +1539,40 @@ if st.session_state.role == "manager":
                             "trip_km": int(start_meter), "fuel_liters": 0.0,
                             "start_date": start_date.strftime("%Y-%m-%d")
                         }).execute()
+                        invalidate("vehicles")
                         st.success(f"Added successfully with start date {start_date}!"); st.rerun()
                     except Exception as e:
                         st.error("⚠️ Please add a 'start_date' column (Type: text) to your 'vehicles' table in Supabase first!")
             
             elif action == "Edit Driver Name":
-                if not df.empty and 'plate' in df.columns:
-                    target_edit = st.selectbox("Select Bus", df['plate'].unique(), key="edit_driver")
-                    curr_driver = df[df['plate'] == target_edit]['driver'].values[0]
+                if fleet["plates"]:
+                    target_edit = st.selectbox("Select Bus", fleet["plates"], key="edit_driver")
+                    curr_driver = fleet["by_plate"][target_edit]['driver']
                     new_driver = st.text_input("Update Driver", value=curr_driver, key="update_driver_name").upper().strip()
                     if st.button("Update Driver"):
-                        supabase.table("vehicles").update({"driver": new_driver}).eq("plate", target_edit).execute()
+                        queue_vehicle_update(target_edit, {"driver": new_driver})
                         st.success("Updated!"); st.rerun()
             elif action == "Delete Bus":
-                if not df.empty and 'plate' in df.columns:
-                    target_del = st.selectbox("Select Bus", df['plate'].unique(), key="del_bus")
+                if fleet["plates"]:
+                    target_del = st.selectbox("Select Bus", fleet["plates"], key="del_bus")
                     if st.button("Delete Permanently"):
                         supabase.table("vehicles").delete().eq("plate", target_del).execute()
+                        invalidate("vehicles")
                         st.success("Deleted!"); st.rerun()
 
         with st.expander("⏱️ Correct a Live Odometer"):
-            if not df.empty and 'plate' in df.columns:
-                target_odo = st.selectbox("Select Bus", df['plate'].unique(), key="edit_odo")
-                curr_odo = df[df['plate'] == target_odo]['odo'].values[0]
+            if fleet["plates"]:
+                target_odo = st.selectbox("Select Bus", fleet["plates"], key="edit_odo")
+                curr_odo = fleet["by_plate"][target_odo]['odo']
                 new_odo_val = st.number_input("Correct Odometer Reading", value=int(curr_odo), key="force_odo_update")
                 if st.button("Force Update Odometer"):
-                    supabase.table("vehicles").update({"odo": int(new_odo_val)}).eq("plate", target_odo).execute()
+                    queue_vehicle_update(target_odo, {"odo": int(new_odo_val)})
                     st.success("Odometer Corrected!"); st.rerun()
 
         with st.expander("⛽ Correct a Past Fuel Fill-up Log"):
-            c_logs_df = load_data("logs")
-            if not c_logs_df.empty and 'id' in c_logs_df.columns:
-                c_logs_df['label'] = c_logs_df['date'].astype(str) + " | " + c_logs_df['plate'] + " | " + c_logs_df['liters'].astype(str) + "L"
-                log_map = dict(zip(c_logs_df['label'], c_logs_df['id']))
-                
-                selected_log_label = st.selectbox("Select Fuel Entry to Fix", c_logs_df['label'].tolist(), key="fix_fuel_entry")
-                selected_log_id = log_map[selected_log_label]
-                log_data = c_logs_df[c_logs_df['id'] == selected_log_id].iloc[0]
+            log_data = record_search("logs", "id,date,plate,liters,total_cost", "liters", "Liters", lambda r: f"{r['date']} | {r['plate']} | {r['liters']}L | ₹{r['total_cost']}", "fix_fuel")
+            if log_data is not None:
+                selected_log_id = log_data['id']
                 
                 c1, c2, c3 = st.columns(3)
                 fix_km = c1.number_input("Fix KM Run", value=int(log_data['km_run']), key="fix_fuel_km")
@@ -399,34 +1580,27 @@ if st.session_state.role == "manager":
                 fix_rate = c3.number_input("Fix Rate (₹)", value=float(log_data.get('rate_per_ltr', 0.0)), key="fix_fuel_rate")
                 
                 if st.button("Update Fuel Record"):
-                    # Find the previous log to recalculate mileage properly
-                    try:
-                        prev_log_corr = supabase.table("logs").select("liters").eq("plate", log_data['plate']).lt("date", log_data['date']).order("date", desc=True).limit(1).execute().data
-                        prev_liters_corr = float(prev_log_corr[0]['liters']) if prev_log_corr else 0.0
-                    except:
-                        prev_liters_corr = 0.0
-                        
-                    new_mileage = round(fix_km / prev_liters_corr, 2) if prev_liters_corr > 0 else 0.0
                     new_cost = fix_liters * fix_rate
                     supabase.table("logs").update({
-                        "km_run": fix_km, "liters": fix_liters, "rate_per_ltr": fix_rate,
-                        "mileage": new_mileage, "total_cost": new_cost
+                        "km_run": fix_km, "liters": fix_liters, "rate_per_ltr": fix_rate, "total_cost": new_cost
                     }).eq("id", int(selected_log_id)).execute()
+                    invalidate("logs"); unarchive("logs", [log_data['date']])
+                    apply_rollups(fuel_deltas(log_data['plate'], log_data['driver'], log_data['date'], log_data['km_run'], log_data['liters'], log_data['total_cost'], sign=-1)
+                                  + fuel_deltas(log_data['plate'], log_data['driver'], log_data['date'], fix_km, fix_liters, new_cost))
+                    recompute_mileage(log_data['plate'], log_data['date'])
                     st.success("Fuel Log Corrected!"); st.rerun()
                 
                 if st.button("🗑️ Delete this Fuel Entry"):
                     supabase.table("logs").delete().eq("id", int(selected_log_id)).execute()
+                    invalidate("logs"); unarchive("logs", [log_data['date']])
+                    apply_rollups(fuel_deltas(log_data['plate'], log_data['driver'], log_data['date'], log_data['km_run'], log_data['liters'], log_data['total_cost'], sign=-1))
+                    recompute_mileage(log_data['plate'], log_data['date'])
                     st.success("Entry Deleted!"); st.rerun()
 
         with st.expander("🔧 Correct a Maintenance Record"):
-            c_maint_df = load_data("maintenance")
-            if not c_maint_df.empty and 'id' in c_maint_df.columns:
-                c_maint_df['label'] = c_maint_df['date'].astype(str) + " | " + c_maint_df['plate'] + " | " + c_maint_df['work_type']
-                maint_map = dict(zip(c_maint_df['label'], c_maint_df['id']))
-                
-                selected_m_label = st.selectbox("Select Repair Entry to Fix", c_maint_df['label'].tolist(), key="fix_maint_entry")
-                selected_m_id = maint_map[selected_m_label]
-                m_data = c_maint_df[c_maint_df['id'] == selected_m_id].iloc[0]
+            m_data = record_search("maintenance", "id,date,plate,work_type,cost", "cost", "Cost (₹)", lambda r: f"{r['date']} | {r['plate']} | {r['work_type']} | ₹{r['cost']}", "fix_maint")
+            if m_data is not None:
+                selected_m_id = m_data['id']
                 
                 fix_m_cost = st.number_input("Fix Cost (₹)", value=float(m_data['cost']), key="fix_maint_cost")
                 fix_m_notes = st.text_input("Fix Notes", value=str(m_data['notes']), key="fix_maint_notes")
@@ -435,57 +1609,193 @@ if st.session_state.role == "manager":
                     supabase.table("maintenance").update({
                         "cost": fix_m_cost, "notes": fix_m_notes
                     }).eq("id", int(selected_m_id)).execute()
+                    invalidate("maintenance"); unarchive("maintenance", [m_data['date']])
+                    apply_rollups(repair_deltas(m_data['plate'], m_data['date'], m_data['cost'], sign=-1) + repair_deltas(m_data['plate'], m_data['date'], fix_m_cost))
                     st.success("Repair Corrected!"); st.rerun()
                 
                 if st.button("🗑️ Delete this Repair Entry"):
                     supabase.table("maintenance").delete().eq("id", int(selected_m_id)).execute()
+                    invalidate("maintenance"); unarchive("maintenance", [m_data['date']])
+                    apply_rollups(repair_deltas(m_data['plate'], m_data['date'], m_data['cost'], sign=-1))
                     st.success("Repair Deleted!"); st.rerun()
 
+        with st.expander("📤 Import Diesel Bills / Repair Invoices (CSV or Excel)"):
+            imp_kind = st.radio("Statement Type:", ["Diesel Bills", "Repair Invoices"], horizontal=True, key="import_kind")
+            if imp_kind == "Diesel Bills":
+                st.caption("Columns: date, plate, km_run, liters, rate_per_ltr (driver is optional). Total cost and mileage are calculated.")
+            else:
+                st.caption("Columns: date, plate, work_type, cost (notes and odo are optional).")
+            uploaded = st.file_uploader("Upload Statement", type=["csv", "xlsx"], key="import_file")
+            if uploaded is not None and not df.empty:
+                fingerprint = (imp_kind, hashlib.sha1(uploaded.getvalue()).hexdigest())
+                if st.session_state.get('imported_statement') == fingerprint:
+                    # A second click or rerun must not insert the same bills twice
+                    st.info("✅ This statement was already imported. Upload the next one.")
+                else:
+                    try:
+                        raw = read_statement(uploaded)
+                        rows, problems = prepare_fuel_import(raw, df) if imp_kind == "Diesel Bills" else prepare_repair_import(raw, df)
+                    except Exception as e:
+                        rows, problems = pd.DataFrame(), [f"Could not read the file: {e}"]
+                    for p in problems: st.warning(f"⚠️ Skipped {p}")
+                    if not rows.empty:
+                        st.dataframe(rows.head(50), use_container_width=True, hide_index=True)
+                        if st.button(f"Import {len(rows)} Rows"):
+                            bar = st.progress(0.0, text="Importing...")
+                            try:
+                                report = lambda done, total: bar.progress(done / total, text=f"Importing... {done}/{total}")
+                                if imp_kind == "Diesel Bills": import_fuel(rows, df, report)
+                                else: import_repairs(rows, report)
+                                st.session_state.imported_statement = fingerprint
+                                st.success(f"✅ Imported {len(rows)} rows!")
+                            except Exception as e:
+                                st.error(f"Import stopped: {e}")
+
+        with st.expander("🧮 Recompute Mileage for All Buses"):
+            st.write("Recalculates every fuel log's mileage (KM run / liters of the previous fill-up) and saves only the ones that were wrong.")
+            if st.button("Recompute All Mileage"):
+                with st.spinner("Recomputing..."):
+                    fixed = recompute_all_mileage()
+                st.success(f"Done! {fixed} fuel logs had a stale mileage and were corrected.")
+
+        with st.expander("🔁 Rebuild Vehicle Totals"):
+            st.write("Recomputes the running totals used by the Monthly and Maintenance sheets from every fuel and repair record, and repairs any that drifted.")
+            if st.button("Rebuild Vehicle Totals"):
+                try:
+                    with st.spinner("Rebuilding totals..."):
+                        repaired = rebuild_rollups()
+                    st.success(f"Totals rebuilt! {repaired} drifted rows repaired.")
+                except Exception as e:
+                    st.error(f"⚠️ Rebuild failed. Did you run sql/rollups.sql in Supabase? ({e})")
+
     # 6. BACKUPS & 7. DANGER
-    with t6:
+    if section == "☁️ Backups":
         st.subheader("☁️ Auto-Backup Archive")
-        backups_df = load_data("backups")
-        if not backups_df.empty: st.dataframe(backups_df[['id', 'backup_date', 'event_type']].sort_values(by="id", ascending=False), use_container_width=True, hide_index=True)
+        c1, c2 = st.columns(2)
+        if c1.button("☁️ Back Up Now"):
+            if not submit_job("Manual Backup", manual_backup_job):
+                st.warning("A backup is already running.")
+        if c2.button("🗄️ Archive Closed Months"):
+            if not submit_job("Month-End Archive", archive_job):
+                st.warning("Archiving is already running.")
+        archive = {t: archived_months(t) for t in ARCHIVE_SCHEMAS}
+        st.caption("🗄️ Local archive: " + " | ".join(f"{t}: {month_label(m[0])} → {month_label(m[-1])}" if m else f"{t}: nothing archived" for t, m in archive.items())
+                   + f" (closed up to {month_label(last_closed_month())})")
+        # Metadata only: the payload columns and chunks are never downloaded just to list backups
+        backups_df = load_data("backups", BACKUP_META_COLUMNS)
+        if backups_df.empty: backups_df = load_data("backups", "id,backup_date,event_type")
+        if not backups_df.empty:
+            backups_df = backups_df.sort_values(by="id", ascending=False)
+            st.dataframe(backups_df.drop(columns="watermarks", errors="ignore"), use_container_width=True, hide_index=True)
+            if 'kind' in backups_df.columns:
+                ok = [restorable(k, w) for k, w in zip(backups_df['kind'], backups_df.get('watermarks', pd.Series(None, index=backups_df.index)))]
+                restore_ids = backups_df.loc[ok, 'id'].tolist()
+                newest = backups_df['watermarks'].iloc[0] if 'watermarks' in backups_df.columns else None
+                marks = newest.get("updated_at") or {} if isinstance(newest, dict) else {}
+                if backups_df['kind'].iloc[0] in ("base", "delta") and any(t not in marks for t in BACKUP_TABLES if t != "vehicles"):
+                    st.caption("ℹ️ Every backup is a full copy until the updated_at columns of sql/backups.sql are added in Supabase.")
+            else:
+                restore_ids = backups_df['id'].tolist()
+
+            with st.expander("♻️ Restore a Backup"):
+                st.warning("This puts ALL vehicles, fuel logs and repairs back exactly as they were at the chosen backup. A full backup of the current data is taken first.")
+                if len(restore_ids) < len(backups_df): st.caption("Older delta backups that did not record edits are not listed.")
+                restore_id = st.selectbox("Select Backup", restore_ids, format_func=lambda i: f"#{i} | {backups_df.loc[backups_df['id'] == i, 'backup_date'].iloc[0]} | {backups_df.loc[backups_df['id'] == i, 'event_type'].iloc[0]}", key="restore_backup_id")
+                confirm_restore = st.text_input("Type 'RESTORE' to confirm:", key="restore_confirm")
+                if st.button("♻️ Restore Selected Backup"):
+                    if confirm_restore != "RESTORE":
+                        st.error("You must type 'RESTORE' exactly in the box above before clicking the button.")
+                    elif submit_job("Restore Backup", restore_job(int(restore_id))):
+                        st.success("Restore started. Progress is shown in the sidebar.")
+                    else:
+                        st.warning("A restore is already running.")
     
-    with t7:
+    if section == "🚨 DANGER":
         st.error("⚠️ MASTER RESET - FACTORY WIPE")
         st.write("This will permanently erase ALL vehicles, ALL monthly fuel logs, and ALL maintenance history.")
         confirm_reset = st.text_input("Type 'RESET ALL' to confirm your action:", key="factory_reset_input")
         if st.button("🚨 ERASE ENTIRE SYSTEM"):
             if confirm_reset == "RESET ALL":
-                trigger_auto_backup("Emergency Backup before Factory Wipe")
-                if not df.empty and 'plate' in df.columns:
-                    for p in df['plate'].unique(): supabase.table("vehicles").delete().eq("plate", p).execute()
-                logs_df_wipe = load_data("logs")
-                if not logs_df_wipe.empty and 'id' in logs_df_wipe.columns:
-                    for l_id in logs_df_wipe['id'].unique(): supabase.table("logs").delete().eq("id", int(l_id)).execute()
-                maint_df_wipe = load_data("maintenance")
-                if not maint_df_wipe.empty and 'id' in maint_df_wipe.columns:
-                    for m_id in maint_df_wipe['id'].unique(): supabase.table("maintenance").delete().eq("id", int(m_id)).execute()
-                st.success("FACTORY RESET COMPLETE!"); st.rerun()
+                if submit_job("Factory Wipe", factory_wipe_job):
+                    st.success("Emergency backup and factory wipe started. Progress is shown in the sidebar.")
+                else:
+                    st.warning("A factory wipe is already running.")
             else:
                 st.error("You must type 'RESET ALL' exactly in the box above before clicking the button.")
 
-# --- 6. DRIVER INTERFACE ---
+    if section == "🩺 Diagnostics":
+        st.subheader("🩺 Performance Diagnostics")
+        enabled = st.toggle("Record timings of every click (all users)", value=PERF["enabled"], key="perf_enabled")
+        if enabled != PERF["enabled"]:
+            PERF["enabled"] = enabled; st.rerun()
+        runs = perf_runs()
+        if not runs:
+            st.info("Nothing recorded yet. Switch recording on and use the app for a while.")
+        else:
+            sections, steps, tables, slowest = perf_summary(runs)
+            st.caption(f"Last {len(runs)} reruns and background jobs (newest {runs[-1]['started']}).")
+            st.write("**⏱️ Per section**")
+            st.dataframe(sections, use_container_width=True, hide_index=True)
+            st.write("**🧩 Median ms per step** (connect → fleet → page → sidebar)")
+            st.dataframe(steps, use_container_width=True, hide_index=True)
+            st.write("**🐢 Slowest reruns**")
+            st.dataframe(slowest, use_container_width=True, hide_index=True)
+            st.write("**🗄️ Supabase calls by table**")
+            st.dataframe(tables, use_container_width=True, hide_index=True)
+            c1, c2 = st.columns(2)
+            c1.download_button("📥 Export JSON", data=lambda: json.dumps(perf_runs(), default=str, indent=1),
+                               file_name=f"Akshara_Perf_{datetime.now().strftime('%Y%m%d_%H%M')}.json", mime="application/json", on_click="ignore")
+            if c2.button("🧹 Clear Recordings"):
+                PERF["runs"].clear(); st.rerun()
+
+# --- 16. DRIVER INTERFACE ---
 else:
     st.markdown(f'<h2 style="color:#000080;text-align:center;">👋 Welcome, {st.session_state.user}</h2>', unsafe_allow_html=True)
-    v_data = df[df['driver'].str.upper().str.strip() == st.session_state.user].iloc[0]
+    perf_label("Driver")
+    v_data = fleet["by_plate"][fleet["by_driver"][st.session_state.user]]
     
     st.info("📌 **Instructions:** Please update your current meter reading at the end of your trip or when filling diesel. Hand over the physical diesel bill to the Manager.")
     
-    current_trip_dist = int(v_data['odo']) - int(v_data['trip_km'])
-    live_mileage = round(current_trip_dist / float(v_data['fuel_liters']), 2) if float(v_data['fuel_liters']) > 0 else 0.0
+    current_trip_dist = int(trip_km(v_data['odo'], v_data['trip_km']))
+    trip_mileage = float(live_mileage(current_trip_dist, v_data['fuel_liters']))
 
     c1, c2, c3 = st.columns(3)
     c1.metric("📌 Odometer", f"{v_data['odo']} km")
     c2.metric("🛣️ Current Trip", f"{current_trip_dist} km")
-    c3.metric("⛽ Live Mileage", f"{live_mileage} km/l")
+    c3.metric("⛽ Live Mileage", f"{trip_mileage} km/l")
     st.divider()
 
     new_odo = st.number_input("Update New Meter Reading", min_value=float(v_data['odo']), value=float(v_data['odo']), key="driver_odo_input")
     if st.button("Update Odometer", key="driver_odo_btn"):
-        supabase.table("vehicles").update({"odo": int(new_odo)}).eq("plate", v_data['plate']).execute()
+        # Saved on this server at once; the upload happens in the background, so poor signal never blocks the screen
+        queue_vehicle_update(v_data['plate'], {"odo": int(new_odo)}, monotonic=True)
         st.success("✅ Odometer updated! The Manager will handle the diesel entry."); st.rerun()
 
+    st.fragment(sync_badge, run_every=3 if sync_status(v_data['plate'])[0] else None)(v_data['plate'])
+
+perf_lap("page")
+
+if st.session_state.role == "manager":
+    with st.sidebar:
+        st.fragment(job_status_panel, run_every=2 if job_status()["state"] == "running" else None)()
+
+pending, _ = sync_status()
+if pending:
+    errors = [e["error"] for e in pending.values() if e["error"]]
+    st.sidebar.caption(f"⏳ {len(pending)} vehicle update(s) waiting to sync" + (f" — last error: {errors[-1]}" if errors else ""))
+stale = rollups_stale()
+if stale and st.session_state.role == "manager":
+    st.sidebar.warning(f"⚠️ Vehicle totals missed an update at {stale[1]} ({stale[0]}). Reports read the full logs until you run 🔁 Rebuild Vehicle Totals in Corrections.")
+conn_status = _connection()
+if conn_status["healthy"]:
+    st.sidebar.caption(f"🟢 Database connected (reconnects: {conn_status['reconnects']})")
+else:
+    st.sidebar.caption(f"🔴 Database unreachable: {conn_status['error']}")
+    if st.sidebar.button("🔄 Reconnect"):
+        check_connection(); st.rerun()
+
 if st.sidebar.button("Logout"):
     st.session_state.clear(); st.rerun()
+
+perf_lap("sidebar")
+perf_finish(st.session_state.pop("_perf_run", None))
@@ -0,0 +1,231 @@
+"""In-memory stand-in for the Supabase client, for benchmarks and offline runs of app.py.
+
+Implements the part of the supabase-py / PostgREST query chain that app.py uses:
+
+    client.table(name).select(cols, count="exact").eq(...).order(...).range(a, b).execute()
+    client.table(name).insert(rows) / .upsert(rows, on_conflict=...) / .update(patch) / .delete()
+    client.rpc("apply_rollup_deltas" | "reset_id_sequences", params).execute()
+
+Like the hosted database, a select never returns more than `row_cap` rows and every execute()
+costs one round trip of `latency` seconds (plus up to `jitter`). The report RPCs of
+sql/reports.sql are not implemented, so app.py takes its rollup / local fallbacks.
+"""
+import itertools
+import random
+import threading
+import time
+from collections import Counter
+
+PRIMARY_KEYS = {"vehicles": ("plate",), "vehicle_rollups": ("plate", "period", "driver")}
+ROLLUP_FIELDS = ("km_run", "liters", "fuel_cost", "repairs", "repair_cost")
+
+_TESTS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+    "in": lambda a, b: a in b,
+}
+
+
+class APIResponse:
+    def __init__(self, data, count=None):
+        self.data, self.count = data, count
+
+
+class Query:
+    """One request being built; every method returns the query itself, like postgrest-py."""
+
+    def __init__(self, client, table):
+        self.client, self.table_name = client, table
+        self.op, self.payload, self.columns, self.want_count = "select", None, "*", False
+        self.on_conflict = None
+        self.filters, self.ordering, self.row_limit, self.row_range = [], [], None, None
+
+    def select(self, *columns, count=None, head=None):
+        self.columns = ",".join(columns) or "*"
+        self.want_count = count is not None
+        return self
+
+    def insert(self, json, **kwargs):
+        self.op, self.payload = "insert", json
+        return self
+
+    def upsert(self, json, on_conflict="", **kwargs):
+        self.op, self.payload, self.on_conflict = "upsert", json, on_conflict
+        return self
+
+    def update(self, json, **kwargs):
+        self.op, self.payload = "update", json
+        return self
+
+    def delete(self, **kwargs):
+        self.op = "delete"
+        return self
+
+    def _filter(self, test, column, value):
+        self.filters.append((test, column, value))
+        return self
+
+    def eq(self, column, value): return self._filter("eq", column, value)
+    def neq(self, column, value): return self._filter("neq", column, value)
+    def gt(self, column, value): return self._filter("gt", column, value)
+    def gte(self, column, value): return self._filter("gte", column, value)
+    def lt(self, column, value): return self._filter("lt", column, value)
+    def lte(self, column, value): return self._filter("lte", column, value)
+    def in_(self, column, values): return self._filter("in", column, frozenset(values))
+
+    def order(self, column, desc=False, **kwargs):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, size):
+        self.row_limit = size
+        return self
+
+    def range(self, start, end):
+        self.row_range = (start, end)
+        return self
+
+    def execute(self):
+        return self.client._execute(self)
+
+
+class RPC:
+    def __init__(self, client, fn, params):
+        self.client, self.fn, self.params = client, fn, params or {}
+
+    def execute(self):
+        return self.client._rpc(self.fn, self.params)
+
+
+class FakeSupabase:
+    """Drop-in for supabase.Client. `tables` maps a table name to its list of row dicts."""
+
+    def __init__(self, tables=None, latency=0.0, jitter=0.0, row_cap=1000, rpcs=True, seed=0):
+        self.tables = {name: list(rows) for name, rows in (tables or {}).items()}
+        self.latency, self.jitter, self.row_cap, self.rpcs = latency, jitter, row_cap, rpcs
+        self.calls = Counter()          # (table, op) -> round trips
+        self.rows_out = 0               # Rows returned by selects
+        self._ids = {}
+        self._versions = Counter()
+        self._views = {}                # (table, filters, ordering, version) -> matching rows
+        self._lock = threading.RLock()
+        self._random = random.Random(seed)
+        for name, rows in self.tables.items():
+            self._ids[name] = itertools.count(max((r.get("id") or 0 for r in rows), default=0) + 1)
+
+    # --- supabase.Client surface ---
+    def table(self, name):
+        return Query(self, name)
+
+    from_ = table
+
+    def rpc(self, fn, params=None, **kwargs):
+        return RPC(self, fn, params)
+
+    # --- bookkeeping for benchmarks ---
+    @property
+    def round_trips(self):
+        return sum(self.calls.values())
+
+    def reset_counters(self):
+        self.calls.clear(); self.rows_out = 0
+
+    def _round_trip(self, table, op):
+        with self._lock: self.calls[(table, op)] += 1
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self._random.uniform(0, self.jitter))
+
+    # --- execution ---
+    def _key(self, table):
+        return PRIMARY_KEYS.get(table, ("id",))
+
+    def _matching(self, q):
+        # Filtered + sorted rows are kept per table version, so paging through a big table stays linear
+        rows = self.tables.setdefault(q.table_name, [])
+        sig = (q.table_name, tuple(q.filters), tuple(q.ordering), self._versions[q.table_name])
+        view = self._views.get(sig)
+        if view is None:
+            view = [r for r in rows if all(_TESTS[t](r.get(c), v) for t, c, v in q.filters)]
+            for column, desc in reversed(q.ordering):
+                view.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+            if q.op == "select":
+                if len(self._views) > 64: self._views.clear()
+                self._views[sig] = view
+        return view
+
+    def _execute(self, q):
+        self._round_trip(q.table_name, q.op)
+        with self._lock:
+            return getattr(self, "_" + q.op)(q)
+
+    def _select(self, q):
+        view = self._matching(q)
+        start, end = q.row_range or (0, len(view) - 1)
+        size = min(end - start + 1, q.row_limit if q.row_limit is not None else self.row_cap, self.row_cap)
+        page = view[start:start + max(size, 0)]
+        if q.columns == "*":
+            data = [dict(r) for r in page]
+        else:
+            cols = [c.strip() for c in q.columns.split(",")]
+            data = [{c: r.get(c) for c in cols} for r in page]
+        self.rows_out += len(data)
+        return APIResponse(data, len(view) if q.want_count else None)
+
+    def _write(self, q, upsert):
+        rows = self.tables.setdefault(q.table_name, [])
+        key = tuple(c.strip() for c in q.on_conflict.split(",")) if q.on_conflict else self._key(q.table_name)
+        index = {tuple(r.get(k) for k in key): r for r in rows}
+        counter = self._ids.setdefault(q.table_name, itertools.count(1))
+        out = []
+        for new in (q.payload if isinstance(q.payload, list) else [q.payload]):
+            new = dict(new)
+            if key == ("id",) and new.get("id") is None: new["id"] = next(counter)
+            existing = index.get(tuple(new.get(k) for k in key))
+            if existing is not None and not upsert:
+                raise Exception(f'duplicate key value violates unique constraint "{q.table_name}_pkey"')
+            if existing is not None:
+                existing.update(new); out.append(dict(existing))
+            else:
+                rows.append(new); index[tuple(new.get(k) for k in key)] = new; out.append(dict(new))
+        self._versions[q.table_name] += 1
+        return APIResponse(out)
+
+    def _insert(self, q): return self._write(q, upsert=False)
+    def _upsert(self, q): return self._write(q, upsert=True)
+
+    def _update(self, q):
+        hit = self._matching(q)
+        for r in hit: r.update(q.payload)
+        self._versions[q.table_name] += 1
+        return APIResponse([dict(r) for r in hit])
+
+    def _delete(self, q):
+        hit = self._matching(q)
+        gone = {id(r) for r in hit}
+        self.tables[q.table_name] = [r for r in self.tables[q.table_name] if id(r) not in gone]
+        self._versions[q.table_name] += 1
+        return APIResponse([dict(r) for r in hit])
+
+    def _rpc(self, fn, params):
+        self._round_trip("rpc:" + fn, "rpc")
+        with self._lock:
+            if self.rpcs and fn == "apply_rollup_deltas":
+                rows = self.tables.setdefault("vehicle_rollups", [])
+                index = {(r["plate"], r["period"], r["driver"]): r for r in rows}
+                for d in params["p_deltas"]:
+                    row = index.get((d["plate"], d["period"], d["driver"]))
+                    if row is None:
+                        row = {"plate": d["plate"], "period": d["period"], "driver": d["driver"], **{f: 0 for f in ROLLUP_FIELDS}}
+                        rows.append(row); index[(d["plate"], d["period"], d["driver"])] = row
+                    for f in ROLLUP_FIELDS: row[f] += d.get(f, 0)
+                self._versions["vehicle_rollups"] += 1
+                return APIResponse(len(params["p_deltas"]))
+            if self.rpcs and fn == "reset_id_sequences":
+                for name, rows in self.tables.items():
+                    self._ids[name] = itertools.count(max((r.get("id") or 0 for r in rows), default=0) + 1)
+                return APIResponse(None)
+        raise Exception(f"Could not find the function public.{fn} in the schema cache")
@@ -0,0 +1,135 @@
+"""Benchmarks app.py against the in-memory Supabase stand-in, through Streamlit's AppTest.
+
+    python bench/run_bench.py                              # 10, 100 and 1000 buses, 1 year of daily logs
+    python bench/run_bench.py --sizes 50 --years 2 --latency-ms 40 --json bench.json
+
+For each fleet size it drives the login page, the manager login (including the daily
+backup job it starts), every manager dashboard section (first visit, then a plain rerun)
+and a driver login + odometer update. Each step reports wall time, Supabase round trips,
+rows returned and the tracemalloc peak. Run it before deploying and compare with the last run.
+tracemalloc makes Python several times slower; compare timings with --no-memory runs.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(os.path.dirname(HERE), "app.py")
+sys.path.insert(0, HERE)
+
+import streamlit as st  # noqa: E402
+import supabase  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+from fake_supabase import FakeSupabase  # noqa: E402
+from synthetic import generate  # noqa: E402
+
+TIMEOUT = 900           # Seconds AppTest may spend on one rerun of the biggest fleets
+
+
+class Bench:
+    def __init__(self, client, memory):
+        self.client, self.memory, self.steps = client, memory, []
+
+    def step(self, name, action):
+        self.client.reset_counters()
+        if self.memory: tracemalloc.reset_peak()
+        start = time.perf_counter()
+        at = action()
+        ms = (time.perf_counter() - start) * 1000
+        peak = tracemalloc.get_traced_memory()[1] / 2**20 if self.memory else None
+        if at is not None and at.exception:
+            raise RuntimeError(f"{name}: {at.exception[0].message}")
+        self.steps.append({"step": name, "ms": round(ms, 1), "round_trips": self.client.round_trips,
+                           "rows": self.client.rows_out, "peak_mb": round(peak, 1) if peak is not None else None})
+        return at
+
+
+def new_app():
+    at = AppTest.from_file(APP, default_timeout=TIMEOUT)
+    at.secrets["SUPABASE_URL"] = "http://bench.invalid"
+    at.secrets["SUPABASE_KEY"] = "bench"
+    return at
+
+
+def button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+
+def wait_for(check, timeout=TIMEOUT):
+    end = time.time() + timeout
+    while not check():
+        if time.time() > end: raise TimeoutError("background job did not finish")
+        time.sleep(0.05)
+
+
+def run_size(vehicles, args):
+    tables = generate(vehicles=vehicles, years=args.years, fill_every=args.fill_every)
+    client = FakeSupabase(tables, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, row_cap=args.row_cap)
+    supabase.create_client = lambda *a, **k: client
+    # The write queue and the month archive go to a throwaway folder, never into the checkout
+    scratch = tempfile.mkdtemp(prefix=f"akshara_bench_{vehicles}_")
+    os.environ["AKSHARA_WRITE_QUEUE_DB"] = os.path.join(scratch, "write_queue.db")
+    os.environ["AKSHARA_ARCHIVE_DIR"] = os.path.join(scratch, "archive")
+    # Every size starts cold: no cached tables, no shared connection
+    st.cache_data.clear(); st.cache_resource.clear()
+    bench = Bench(client, args.memory)
+
+    at = new_app()
+    bench.step("login page", lambda: at.run())
+    at.text_input[0].input("MANAGER").run()
+    at.text_input[1].input("Akshara@2026")
+    bench.step("manager login", lambda: button(at, "Login as Manager").click().run())
+    bench.step("daily backup job", lambda: wait_for(lambda: client.tables.get("backups")))
+
+    radio = at.radio(key="mgr_section")
+    for section in radio.options:
+        bench.step(f"{section} (first visit)", lambda: at.radio(key="mgr_section").set_value(section).run())
+        bench.step(f"{section} (rerun)", lambda: at.run())
+
+    driver_at = new_app()
+    driver_at.run()
+    driver_at.text_input[0].input(tables["vehicles"][0]["driver"]).run()
+    bench.step("driver login", lambda: button(driver_at, "Login as Driver").click().run())
+    driver_at.number_input(key="driver_odo_input").set_value(float(tables["vehicles"][0]["odo"]) + 120)
+    bench.step("driver odometer update", lambda: driver_at.button(key="driver_odo_btn").click().run())
+    bench.step("driver rerun", lambda: driver_at.run())
+    return {"vehicles": vehicles, "logs": len(tables["logs"]), "maintenance": len(tables["maintenance"]), "steps": bench.steps}
+
+
+def print_result(result):
+    print(f"\n=== {result['vehicles']} buses | {result['logs']:,} fuel logs | {result['maintenance']:,} repairs ===")
+    print(f"{'step':<34}{'ms':>10}{'trips':>8}{'rows':>10}{'peak MB':>10}")
+    for s in result["steps"]:
+        peak = "-" if s["peak_mb"] is None else f"{s['peak_mb']:.1f}"
+        print(f"{s['step']:<34}{s['ms']:>10.1f}{s['round_trips']:>8}{s['rows']:>10,}{peak:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="fleet sizes (buses)")
+    parser.add_argument("--years", type=float, default=1, help="years of history per bus")
+    parser.add_argument("--fill-every", type=int, default=1, help="days between fill-ups")
+    parser.add_argument("--latency-ms", type=float, default=20, help="simulated round-trip latency")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="extra random latency per round trip")
+    parser.add_argument("--row-cap", type=int, default=1000, help="max rows per select, like PostgREST")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip tracemalloc (it slows Python down)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.memory: tracemalloc.start()
+    results = []
+    for size in args.sizes:
+        results.append(run_size(size, args))
+        print_result(results[-1])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
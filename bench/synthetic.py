@@ -0,0 +1,90 @@
+"""Synthetic fleet data in the shape of the Supabase tables used by app.py.
+
+    tables = generate(vehicles=100, years=1)
+    client = FakeSupabase(tables)
+
+Every bus fills diesel every `fill_every` days and sees a workshop about once a month.
+Odometers, trip_km/fuel_liters and the "KM run / previous liters" mileage are consistent
+with each other, and vehicle_rollups matches the logs, as if every write went through app.py.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+# Marker row rebuild_rollups() writes; app.py only reads vehicle_rollups once it exists
+REBUILT = {"plate": "", "period": "REBUILT", "driver": "", "km_run": 0, "liters": 0.0, "fuel_cost": 0.0, "repairs": 0, "repair_cost": 0.0}
+WORK_TYPES = ["Oil Change", "Tyre Replacement", "Brake Service", "Battery", "Clutch Plate", "General Service"]
+
+
+def generate(vehicles=100, years=1, fill_every=1, repairs_per_month=1.0, seed=7, end=None):
+    """Returns {table name: list of row dicts} for vehicles, logs, maintenance and vehicle_rollups."""
+    rng = np.random.default_rng(seed)
+    end = end or date.today()
+    start = end - timedelta(days=int(365 * years))
+    days = pd.date_range(start, end - timedelta(days=1), freq=f"{fill_every}D")
+    plates = [f"KA-{1 + i // 9999:02d}-F-{1 + i % 9999:04d}" for i in range(vehicles)]
+    drivers = [f"DRIVER {i + 1:04d}" for i in range(vehicles)]
+
+    # One fill-up per bus per fill day, vectorised over (bus, day)
+    n_days = len(days)
+    km = rng.integers(60, 260, size=(vehicles, n_days)) * fill_every
+    liters = np.round(km / rng.uniform(8.0, 14.0, size=(vehicles, n_days)), 2)
+    rate = np.round(rng.uniform(88.0, 96.0, size=n_days), 2)
+    start_odo = rng.integers(10_000, 200_000, size=vehicles)
+    odo = start_odo[:, None] + np.cumsum(km, axis=1)
+    prev_liters = np.concatenate([np.zeros((vehicles, 1)), liters[:, :-1]], axis=1)
+    mileage = np.round(np.divide(km, prev_liters, out=np.zeros(km.shape), where=prev_liters > 0), 2)
+
+    logs = pd.DataFrame({
+        "date": np.tile(days.strftime("%Y-%m-%d 08:00:00"), vehicles),
+        "plate": np.repeat(plates, n_days), "driver": np.repeat(drivers, n_days),
+        "km_run": km.ravel(), "liters": liters.ravel(), "mileage": mileage.ravel(),
+        "rate_per_ltr": np.tile(rate, vehicles), "odo": odo.ravel(),
+    })
+    logs["total_cost"] = np.round(logs["liters"] * logs["rate_per_ltr"], 2)
+    logs = logs.sort_values(["date", "plate"], kind="stable").reset_index(drop=True)
+    logs.insert(0, "id", np.arange(1, len(logs) + 1))
+
+    # Workshop visits at random days
+    n_repairs = int(round(vehicles * 12 * years * repairs_per_month))
+    maint = pd.DataFrame({
+        "plate": rng.choice(plates, size=n_repairs),
+        "date": (pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, max(int(365 * years), 1), size=n_repairs), unit="D")).strftime("%Y-%m-%d"),
+        "work_type": rng.choice(WORK_TYPES, size=n_repairs),
+        "cost": np.round(rng.uniform(300, 25_000, size=n_repairs), 2),
+        "notes": "", "odo": 0,
+    }).sort_values(["date", "plate"], kind="stable").reset_index(drop=True)
+    maint.insert(0, "id", np.arange(1, len(maint) + 1))
+
+    last_odo = odo[:, -1] if n_days else start_odo
+    vehicles_df = pd.DataFrame({
+        "plate": plates, "driver": drivers,
+        "odo": last_odo + rng.integers(0, 200, size=vehicles),     # Driven a little since the last fill-up
+        "trip_km": last_odo, "fuel_liters": liters[:, -1] if n_days else 0.0,
+        "start_date": start.strftime("%Y-%m-%d"),
+    })
+
+    return {
+        "vehicles": vehicles_df.to_dict("records"),
+        "logs": logs.to_dict("records"),
+        "maintenance": maint.to_dict("records"),
+        "vehicle_rollups": rollups(logs, maint).to_dict("records") + [REBUILT],
+        "backups": [], "backup_chunks": [],
+    }
+
+
+def rollups(logs, maint):
+    """vehicle_rollups rows for the given logs/maintenance, as rebuild_rollups() in app.py computes them."""
+    logs = logs.assign(period=logs["date"].str[:7]).rename(columns={"total_cost": "fuel_cost"})
+    maint = maint.assign(period=maint["date"].str[:7])
+    fuel = ["km_run", "liters", "fuel_cost"]
+    agg = {"repairs": ("cost", "count"), "repair_cost": ("cost", "sum")}
+    parts = [
+        logs.groupby(["plate", "period", "driver"])[fuel].sum().reset_index(),
+        logs.groupby("plate")[fuel].sum().reset_index().assign(period="ALL", driver=""),
+        maint.groupby(["plate", "period"]).agg(**agg).reset_index().assign(driver=""),
+        maint.groupby("plate").agg(**agg).reset_index().assign(period="ALL", driver=""),
+    ]
+    out = pd.concat(parts, ignore_index=True).groupby(["plate", "period", "driver"]).sum(min_count=1).fillna(0).reset_index()
+    return out.astype({"km_run": int, "repairs": int}).round({"liters": 2, "fuel_cost": 2, "repair_cost": 2})
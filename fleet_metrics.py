@@ -0,0 +1,46 @@
+"""Fleet math shared by every screen of app.py.
+
+Every function works on whole columns at once (plain numbers work too), so the Live table,
+the Monthly sheet, the driver screen and the diesel forms all use the same formula.
+A zero or missing liters/KM value gives 0.0 instead of a division error.
+"""
+import numpy as np
+
+KM_DTYPE = np.int32          # Odometers stay far below 2 billion km
+RATIO_DTYPE = np.float64     # Kept at float64 so round(x, 2) prints exactly
+
+
+def safe_ratio(numerator, denominator, decimals=2):
+    """numerator / denominator rounded, with 0.0 wherever the denominator is not positive."""
+    num = np.asarray(numerator, dtype=RATIO_DTYPE)
+    den = np.asarray(denominator, dtype=RATIO_DTYPE)
+    out = np.zeros(np.broadcast(num, den).shape, dtype=RATIO_DTYPE)
+    np.divide(num, den, out=out, where=np.nan_to_num(den) > 0)
+    return np.round(out, decimals)
+
+
+def trip_km(odo, trip_start):
+    """KM driven since the last fill-up: current odometer - odometer at the last fill-up (missing = 0)."""
+    odo = np.nan_to_num(np.asarray(odo, dtype=RATIO_DTYPE))
+    start = np.nan_to_num(np.asarray(trip_start, dtype=RATIO_DTYPE))
+    return (odo - start).astype(KM_DTYPE)
+
+
+def live_mileage(trip, fuel_liters):
+    """Mileage of the trip in progress: trip KM / liters filled at the last fill-up."""
+    return safe_ratio(trip, fuel_liters)
+
+
+def fill_mileage(km_run, previous_liters):
+    """Mileage of one fuel log: its KM run / the liters of the PREVIOUS fill-up of that bus."""
+    return safe_ratio(km_run, previous_liters)
+
+
+def monthly_mileage(total_km, total_liters):
+    """Mileage over a month: total KM / total diesel."""
+    return safe_ratio(total_km, total_liters)
+
+
+def cost_per_km(cost, km):
+    """Rupees spent per KM run."""
+    return safe_ratio(cost, km)
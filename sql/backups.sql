@@ -0,0 +1,59 @@
+-- Akshara Fleet: backups.
+-- Run once in the Supabase SQL editor.
+
+-- Lets the daily backup check look up today's date directly instead of reading every backup
+create index if not exists backups_backup_date_idx on backups (backup_date);
+
+-- Backup metadata. kind = 'base' (full snapshot) or 'delta' (rows changed since the previous
+-- backup of the same base). Old rows keep kind = null and their vehicles_data/logs_data JSON.
+alter table backups add column if not exists kind text;
+alter table backups add column if not exists base_id bigint references backups (id) on delete cascade;
+alter table backups add column if not exists watermarks jsonb;
+alter table backups add column if not exists row_counts jsonb;
+alter table backups add column if not exists size_bytes bigint;
+alter table backups alter column vehicles_data drop not null;
+alter table backups alter column logs_data drop not null;
+create index if not exists backups_base_id_idx on backups (base_id);
+
+-- Backup payloads: gzipped JSON per table, base64 encoded and cut into bounded slices
+create table if not exists backup_chunks (
+    backup_id bigint not null references backups (id) on delete cascade,
+    table_name text not null,
+    seq int not null,
+    payload text not null,
+    primary key (backup_id, table_name, seq)
+);
+
+-- After a restore writes explicit ids, move the id sequences past them
+create or replace function reset_id_sequences()
+returns int
+language plpgsql as $$
+begin
+    perform setval(pg_get_serial_sequence('logs', 'id'), coalesce((select max(id) from logs), 0) + 1, false);
+    perform setval(pg_get_serial_sequence('maintenance', 'id'), coalesce((select max(id) from maintenance), 0) + 1, false);
+    return 1;
+end;
+$$;
+
+-- Delta backups pick up every row inserted or changed since the previous backup by updated_at.
+-- The trigger stamps inserts too, so rows written back by a restore are not missed either.
+alter table logs add column if not exists updated_at timestamptz not null default now();
+alter table maintenance add column if not exists updated_at timestamptz not null default now();
+create index if not exists logs_updated_at_idx on logs (updated_at);
+create index if not exists maintenance_updated_at_idx on maintenance (updated_at);
+
+create or replace function touch_updated_at()
+returns trigger
+language plpgsql as $$
+begin
+    new.updated_at = now();
+    return new;
+end;
+$$;
+
+drop trigger if exists logs_touch_updated_at on logs;
+create trigger logs_touch_updated_at before insert or update on logs
+    for each row execute function touch_updated_at();
+drop trigger if exists maintenance_touch_updated_at on maintenance;
+create trigger maintenance_touch_updated_at before insert or update on maintenance
+    for each row execute function touch_updated_at();
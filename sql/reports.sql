@@ -0,0 +1,50 @@
+-- Akshara Fleet: server-side report functions.
+-- Run once in the Supabase SQL editor. The app falls back to computing the same
+-- numbers itself if these functions are missing, so this file is optional but
+-- makes the Monthly tab transfer only a few dozen rows.
+
+create index if not exists logs_date_idx on logs (date);
+create index if not exists logs_plate_idx on logs (plate);
+create index if not exists maintenance_plate_idx on maintenance (plate);
+
+-- Every month ('YYYY-MM') that has at least one fuel log, oldest first
+create or replace function fleet_log_months()
+returns table (month text)
+language sql stable as $$
+    select distinct to_char(date::timestamp, 'YYYY-MM') as month
+    from logs
+    where date is not null
+    order by 1;
+$$;
+
+-- Per plate/driver totals for one month ('YYYY-MM')
+create or replace function fleet_monthly_report(p_month text)
+returns table (plate text, driver text, total_km bigint, total_liters float8, total_cost float8)
+language sql stable as $$
+    select plate, driver,
+           coalesce(sum(km_run), 0)::bigint,
+           coalesce(sum(liters), 0)::float8,
+           coalesce(sum(total_cost), 0)::float8
+    from logs
+    where date::timestamp >= to_timestamp(p_month || '-01', 'YYYY-MM-DD')
+      and date::timestamp < to_timestamp(p_month || '-01', 'YYYY-MM-DD') + interval '1 month'
+    group by plate, driver
+    order by plate, driver;
+$$;
+
+-- Lifetime fuel and repair spend for every vehicle in the fleet
+create or replace function fleet_lifetime_spend()
+returns table (plate text, fuel_cost float8, repair_cost float8)
+language sql stable as $$
+    select v.plate,
+           coalesce(f.cost, 0)::float8,
+           coalesce(m.cost, 0)::float8
+    from vehicles v
+    left join (select plate, sum(total_cost) as cost from logs group by plate) f on f.plate = v.plate
+    left join (select plate, sum(cost) as cost from maintenance group by plate) m on m.plate = v.plate;
+$$;
+
+-- Correction Center search: filters on plate and walks dates newest first
+create index if not exists logs_plate_date_idx on logs (plate, date desc, id desc);
+create index if not exists maintenance_plate_date_idx on maintenance (plate, date desc, id desc);
+create index if not exists maintenance_date_idx on maintenance (date desc, id desc);
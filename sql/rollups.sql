@@ -0,0 +1,40 @@
+-- Akshara Fleet: running per-vehicle totals.
+-- One row per plate with period = 'ALL' (lifetime) plus one row per plate/month/driver
+-- (period = 'YYYY-MM'). Repair totals for a month are kept on the row with driver = ''.
+-- After creating the table, press "Rebuild Vehicle Totals" in the Corrections tab once.
+-- The rebuild writes a marker row (plate = '', period = 'REBUILT'); until it exists, and whenever a
+-- delta failed since, the app ignores this table and builds its reports from the logs.
+
+create table if not exists vehicle_rollups (
+    plate text not null,
+    period text not null,
+    driver text not null default '',
+    km_run bigint not null default 0,
+    liters float8 not null default 0,
+    fuel_cost float8 not null default 0,
+    repairs int not null default 0,
+    repair_cost float8 not null default 0,
+    primary key (plate, period, driver)
+);
+
+-- Adds a batch of deltas in ONE statement, so either every total moves or none do
+create or replace function apply_rollup_deltas(p_deltas jsonb)
+returns int
+language sql as $$
+    with applied as (
+        insert into vehicle_rollups as r (plate, period, driver, km_run, liters, fuel_cost, repairs, repair_cost)
+        select d.plate, d.period, coalesce(d.driver, ''),
+               coalesce(d.km_run, 0), coalesce(d.liters, 0), coalesce(d.fuel_cost, 0),
+               coalesce(d.repairs, 0), coalesce(d.repair_cost, 0)
+        from jsonb_to_recordset(p_deltas) as d(plate text, period text, driver text, km_run bigint,
+                                              liters float8, fuel_cost float8, repairs int, repair_cost float8)
+        on conflict (plate, period, driver) do update set
+            km_run = r.km_run + excluded.km_run,
+            liters = r.liters + excluded.liters,
+            fuel_cost = r.fuel_cost + excluded.fuel_cost,
+            repairs = r.repairs + excluded.repairs,
+            repair_cost = r.repair_cost + excluded.repair_cost
+        returning 1
+    )
+    select count(*)::int from applied;
+$$;